@@ -3,9 +3,28 @@
 https://github.com/markuskimius/csvmagic
 """
 
+import io
 import os
 import re
 import sys
+import bz2
+import gzip
+import json
+import lzma
+import mmap
+import queue
+import time
+import bisect
+import codecs
+import tempfile
+import functools
+import contextlib
+import importlib
+import itertools
+import weakref
+import threading
+import collections
+import multiprocessing
 
 __copyright__ = 'Copyright 2019-2025 Mark Kim'
 __license__ = 'Apache 2.0'
@@ -18,178 +37,2316 @@ __author__ = 'Mark Kim'
 
 # Delimiters tested when autodetecting the file's delimiter
 DELIMS = os.environ.get('CSV_DELIMS', ',\\t|\\u0001')
+GUESS_DELIMS = DELIMS.encode().decode('unicode_escape')
+
+# Lines, and bytes, read ahead at the start of a table to guess its delimiter
+SNIFF_ROWS = int(os.environ.get('CSV_SNIFF_ROWS', '100'))
+SNIFF_SIZE = 64 * 1024
+
+# Row parsing engine used when the Reader is not given one explicitly
+ENGINE = os.environ.get('CSV_ENGINE', 'regex')
+ENGINES = ('regex', 'fsm')
+
+# Default size of the blocks read by BlockReader
+BLOCK_SIZE = 4 * 1024 * 1024
+
+# Leading bytes of the compressed files smart_open() decompresses
+COMPRESSIONS = (
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bzip2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+)
+
+# Decompressed blocks a Decompressor keeps ready ahead of the reader, and
+# blocks a Compressor keeps queued behind the writer
+DECOMPRESS_DEPTH = 4
+COMPRESS_DEPTH = 4
+
+# Blocks of uncompressed files read ahead of the reader by smart_open(), or 0
+# to read them as they are needed; and whether to report how often either
+# side waited for the other
+PREFETCH_DEPTH = int(os.environ.get('CSV_PREFETCH', '0'))
+PREFETCH_STATS = bool(os.environ.get('CSV_PREFETCH_STATS'))
+
+# Seconds a Follower waits between checks for lines appended to its file
+FOLLOW_INTERVAL = float(os.environ.get('CSV_FOLLOW_INTERVAL', '1'))
+
+# Bytes of the file split into rows by each task of a ParallelReader
+CHUNK_SIZE = 1024 * 1024
+
+# Rows between the offsets recorded by RowIndex
+INDEX_STEP = 10000
+
+# Rows in each Batch of Reader.batches(), and parsed into NumPy arrays at a
+# time by read_columns()
+BATCH_ROWS = 64 * 1024
+
+# Characters a Writer keeps before writing them out in one block, and bytes
+# an OutputFile does
+WRITE_SIZE = 1024 * 1024
+
+# Whether OutputFile.preallocate() reserves space for the file.  It is off by
+# default as file systems that cannot reserve space have it written out.
+PREALLOCATE = bool(os.environ.get('CSV_PREALLOCATE'))
+
+# Encodings in which the quote, newline and delimiters are always single bytes
+# of their own, so a file can be split into fields before it is decoded
+ASCII_ENCODINGS = ('ascii', 'utf-8', 'latin-1', 'iso8859-', 'cp125')
+
+# Number of compiled dialects kept for reuse by get_dialect()
+DIALECT_CACHE_SIZE = 64
+
+# Suffixes accepted by parse_size()
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3}
+
+
+##############################################################################
+# EXCEPTIONS
+
+class DelimiterNotFoundException(Exception): pass
 
 
 ##############################################################################
 # CSV READER
 
 class Reader(object):
-    def __init__(self, file, delim=None, has_header=False, is_multitable=False):
+    def __init__(self, file, delim=None, has_header=False, is_multitable=False, engine=None, sniff_rows=None, sniff_size=None):
+        if engine is None:
+            engine = ENGINE
+
+        if engine not in ENGINES:
+            raise ValueError('Invalid engine -- "%s"' % engine)
+
         self.__init_delim = delim
         self.__has_header = has_header
         self.__is_multitable = is_multitable
         self.__file = file
+        self.__sniff_rows = SNIFF_ROWS if sniff_rows is None else sniff_rows
+        self.__sniff_size = SNIFF_SIZE if sniff_size is None else sniff_size
+        self.__sample = collections.deque()
+        self.__filerow = 0
+        self.__is_restarted = False
+        self.__keeps_lines = False
+
+        # Rows without quotes are split with str.split() rather than the
+        # tokenizer; these count the rows that took each path
+        self.split_rows = 0
+        self.tokenized_rows = 0
+
+        # Sources such as BlockReader hand out lines without the newline
+        if hasattr(file, 'nextline'):
+            self.__nextline = file.nextline
+        else:
+            self.__nextline = self.__readfileline
+
+        # Sources that follow a growing file, such as Follower, wait for more
+        # lines at its end; reading ahead stops short of waiting
+        self.__is_ready = getattr(file, 'ready', None)
+
+        # Binary sources such as MappedReader hand out lines as bytes, whose
+        # fields are decoded only when used
+        if getattr(file, 'binary', False):
+            self.__encoding = file.encoding
+            self.__quote = b'"'
+            self.__newline = b'\n'
+        else:
+            self.__encoding = None
+            self.__quote = '"'
+            self.__newline = '\n'
+
+        # regex: validate the growing row buffer with a regex after each line
+        # fsm: scan each character once, carrying the quote state across lines
+        # Sources such as ParallelReader hand out whole rows instead of lines
+        if getattr(file, 'whole_rows', False):
+            self.__readfields = self.__readfields_whole
+        elif engine == 'fsm':
+            self.__readfields = self.__readfields_fsm
+        else:
+            self.__readfields = self.__readfields_regex
+
+        self.__reset()
+
+    def __reset(self):
+        self.__rownum = 0
+        self.__firstrow = None
+        self.__schema = None
+        self.__is_sot = False
+
+        if self.__init_delim is None:
+            self.__delim = None
+            self.__row_re = None
+            self.__tokenizer = None
+            self.__split_delim = None
+        else:
+            self.__setdelim(self.__init_delim, len(self.__init_delim) > 1)
+
+        if self.__has_header:
+            self.__readrow()
+
+    def header(self):
+        if self.__has_header and self.__is_sot:
+            self.__readrow()
+
+        return self.__firstrow
+
+    def seek(self, rownum):
+        '''Skip to row rownum of the file, counting every row of every table
+        from 0.  If the file has a RowIndex, as MappedReader does, reading
+        starts from the nearest row it recorded.  Otherwise the rows up to
+        rownum are read and discarded, and rows already read are not read
+        again.'''
+
+        index = self.__file.index() if hasattr(self.__file, 'index') else None
+
+        if index is not None:
+            tablerow, offset = index.table(rownum) if self.__is_multitable else (0, 0)
+            startrow, startoffset = tablerow, offset
+
+            # A table of just an empty line changes how the next one is read,
+            # so start from the first of a run of them
+            while self.__is_multitable and startrow > 0:
+                prevrow, prevoffset = index.table(startrow - 1)
+                if prevrow != startrow - 1: break
+
+                startrow, startoffset = prevrow, prevoffset
+
+            if rownum < self.__filerow or startrow > self.__filerow:
+                self.__jump(startrow, startoffset)
+                self.__restart()
+
+            # Read the table as far as its first row, then jump as close to
+            # the row as the index goes
+            self.__skip(min(rownum, tablerow + 1))
+            markrow, offset = index.mark(rownum)
+
+            if markrow > self.__filerow and not self.__is_sot and not self.__is_restarted:
+                self.__rownum += markrow - self.__filerow
+                self.__jump(markrow, offset)
+
+        self.__skip(rownum)
+
+    def __skip(self, rownum):
+        # A new table's header is read along with its first row, so start
+        # the table first in case the header is the row
+        while self.__filerow < rownum:
+            if self.__is_sot and not self.__is_restarted:
+                self.__restart()
+            elif self.__readrow() is None:
+                break
+
+    def tell(self):
+        '''The row number in the file of the next row to be read.'''
+
+        return self.__filerow
+
+    def __restart(self):
+        # Start a table as __readrow does before reading its next row
+        self.__reset()
+        self.__is_restarted = True
+
+    def __jump(self, filerow, offset):
+        self.__file.seek(offset)
+        self.__nextline = self.__file.nextline
+        self.__sample.clear()
+        self.__filerow = filerow
+
+    def next(self):
+        return self.__readrow()
+
+    def __next__(self):
+        return self.__readrow()
+
+    def __iter__(self):
+        while True:
+            row = self.__readrow()
+            if row is None: break
+
+            yield row
+
+    def batches(self, size=BATCH_ROWS, lines=False):
+        '''Iterate the rest of the rows in Batches of up to size rows, the
+        same rows iterating the Reader returns.  A batch ends early at the
+        end of a table, after the empty line that ends it, so the rows of a
+        batch share one header.
+
+        If lines is set, a row without quotes is kept as the line it was
+        read from, a str or bytes as the file hands it out, instead of being
+        split into a list of values.  Only a Reader of a single table
+        without a header keeps lines.'''
+
+        if lines and (self.__has_header or self.__is_multitable):
+            raise ValueError('Lines are kept only for a single table without a header')
+
+        while True:
+            self.__keeps_lines = lines
+            batch = self.__readbatch(size)
+            self.__keeps_lines = False
+
+            if batch is None: break
+
+            yield batch
+
+    def __readbatch(self, size):
+        rows = []
+        start = None
+        schema = None
+
+        while len(rows) < size:
+            # A new table starts a new batch, and so does a wait for rows
+            if rows and self.__is_sot:
+                break
+            elif rows and not self.__ready():
+                break
+
+            values = self.__readvalues()
+            if values is None: break
+
+            if start is None:
+                start = self.__rownum - 1
+                schema = self.__schema
+
+            if self.__keeps_lines and not isinstance(values, FieldList):
+                rows.append(values)
+            else:
+                rows.append(values.as_list())
+
+        if not rows:
+            return None
+
+        return Batch(start, rows, schema, self.__delim)
+
+    def __readrow(self):
+        row = None
+        values = self.__readvalues()
+
+        if values is not None:
+            row = Row(self.__rownum - 1, self.__schema, values, self.__delim)
+
+            if self.__firstrow is None and self.__has_header:
+                self.__firstrow = row
+
+        return row
+
+    def __readvalues(self):
+        # reset at the start of a new table, unless seek() just did
+        if self.__is_sot and not self.__is_restarted:
+            self.__reset()
+
+        self.__is_restarted = False
+        values = self.__readfields()
+
+        if values is not None:
+            # empty line starts a new table on next reading
+            if self.__is_multitable and not values.has(0):
+                self.__is_sot = True
+
+            # current row becomes the header if header not already set; its
+            # schema is shared by every row of the table
+            if self.__schema is None and self.__has_header:
+                self.__schema = Schema(Row(self.__rownum, None, values, self.__delim))
+
+            self.__rownum += 1
+            self.__filerow += 1
+
+        return values
+
+    def __readfields_regex(self):
+        gotline = False
+        buf = self.__newline[:0]
+        line = self.__readline()
+
+        # A line without quotes is a row of its own
+        if line is not None and self.__quote not in line:
+            return self.__split(line)
+
+        while True:
+            if gotline: line = self.__readline()
+            if line is None: break
+
+            if gotline: buf += self.__newline
+            buf += line
+
+            gotline = True
+
+            if self.__is_validrow(buf): break
+
+        if not gotline:
+            return None
+
+        # The row is split into fields only once a field is asked for
+        self.tokenized_rows += 1
+
+        return FieldList(buf, None, self.__tokenizer, self.__encoding)
+
+    def __readfields_fsm(self):
+        line = self.__readline()
+
+        if line is None:
+            return None
+
+        # A line without quotes is a row of its own
+        if self.__quote not in line:
+            return self.__split(line)
+
+        buf, bounds = self.__tokenizer.tokenize(line, self.__readline)
+        self.tokenized_rows += 1
+
+        return FieldList(buf, bounds, self.__tokenizer, self.__encoding)
+
+    def __readfields_whole(self):
+        buf = self.__readline()
+
+        if buf is None:
+            return None
+
+        if self.__quote not in buf:
+            return self.__split(buf)
+
+        self.tokenized_rows += 1
+
+        return FieldList(buf, None, self.__tokenizer, self.__encoding)
+
+    def __split(self, line):
+        # A row without quotes is split on a plain delimiter in one call, and
+        # on a delimiter regex only when a field is asked for
+        delim = self.__split_delim
+
+        if delim is None:
+            self.tokenized_rows += 1
+
+            return FieldList(line, None, self.__tokenizer, self.__encoding)
+
+        self.split_rows += 1
+
+        if self.__keeps_lines:
+            return line
+
+        return SplitFieldList(line.split(delim) if len(line) else [], self.__encoding)
+
+    def __readline(self):
+        # Lines read ahead to guess the delimiter come first
+        line = self.__sample.popleft() if self.__sample else self.__nextline()
+
+        # An empty line ending a table has no delimiter to guess
+        if self.__delim is None and line is not None:
+            if len(line) or not self.__is_multitable:
+                self.__guessdelim(line)
+
+        return line
+
+    def __readfileline(self):
+        line = self.__file.readline()
+
+        if line == '':
+            line = None
+        else:
+            line = line.rstrip('\n')
+
+        return line
+
+    def __guessdelim(self, line):
+        sample = [line]
+        size = len(line)
+        pending = self.__sample
+
+        # Read ahead as far as the end of the table
+        while len(sample) < self.__sniff_rows and size < self.__sniff_size:
+            if self.__is_multitable and not len(sample[-1]):
+                break
+
+            if not pending and not self.__ready(): break
+
+            nextline = pending.popleft() if pending else self.__nextline()
+            if nextline is None: break
+
+            sample.append(nextline)
+            size += len(nextline)
+
+        pending.extendleft(reversed(sample[1:]))
+
+        self.__setdelim(guess_delim(sample, self.__encoding))
+
+    def __ready(self):
+        # Whether the next line can be read without waiting for it
+        return self.__is_ready is None or bool(self.__sample) or self.__is_ready()
+
+    def __setdelim(self, delim, is_regex=False):
+        dialect = get_dialect(delim, is_regex, self.__encoding)
+
+        self.__delim = delim
+        self.__row_re = dialect.row_re
+        self.__tokenizer = dialect.tokenizer
+        self.__split_delim = dialect.split_delim
+
+    def __is_validrow(self, buf):
+        return not len(buf) or self.__row_re.match(buf)
+
+
+##############################################################################
+# CSV DIALECT
+
+class Dialect(object):
+    '''The compiled patterns and the tokenizer that parse rows delimited by
+    delim, a regex if is_regex is set.  Patterns match bytes in encoding if
+    it is given.  Use get_dialect() to share them between readers.
+    '''
+
+    def __init__(self, delim, is_regex=False, encoding=None):
+        delim_re = delim if is_regex else re.escape(delim)
+        unquoted_field_r = r'(?:(?!(?:%s)|").)*' % delim_re
+        quoted_field_r = r'"(?:[^"]|"")*"'
+        field_r = r'(?:%s)|(?:%s)' % (unquoted_field_r, quoted_field_r)
+        row_r = r'(?:%s)(?:(?:%s)(?:%s))*' % (field_r, delim_re, field_r)
+        row_r = r'^(%s)$' % row_r
+        field_r = r'^(%s)$' % field_r
+
+        # Binary sources are matched with the byte patterns of their encoding
+        if encoding is not None:
+            row_r = row_r.encode(encoding)
+            field_r = field_r.encode(encoding)
+            delim_re = delim_re.encode(encoding)
+
+        # Rows without quotes split on a plain delimiter with str.split()
+        if is_regex:
+            self.split_delim = None
+        elif encoding is not None:
+            self.split_delim = delim.encode(encoding)
+        else:
+            self.split_delim = delim
+
+        self.delim = delim
+        self.row_re = re.compile(row_r)
+        self.field_re = re.compile(field_r)
+        self.delim_re = re.compile(delim_re)
+        self.tokenizer = Tokenizer(self.delim_re)
+
+
+@functools.lru_cache(maxsize=DIALECT_CACHE_SIZE)
+def get_dialect(delim, is_regex=False, encoding=None):
+    '''Return the Dialect of delim, built once and reused by every reader
+    of the same delimiter.'''
+
+    return Dialect(delim, is_regex, encoding)
+
+
+##############################################################################
+# CSV WRITER
+
+class QUOTING:
+    RAW     = 0
+    AUTO    = 1
+    MINIMAL = 2
+    ALWAYS  = 3
+    STRIP   = 4
+
+
+class Writer(object):
+    '''Write rows to file (default sys.stdout) through a buffer that is
+    written out in blocks of about block_size characters.
+
+    writerow() joins the raw values of a row with delim, quoted as quoting,
+    one of QUOTING, says.  Each quoting has an encoder of its own, which
+    joins a row in one operation when none of its values needs more than
+    that.  If file is binary, as encoded_output() returns, the rows are
+    bytes in encoding and are written raw.
+
+    The buffer is written out by flush() and on leaving a with block.
+    Writer.flush_all() flushes every Writer, and standard output.
+    '''
+
+    __writers = weakref.WeakSet()
+
+    def __init__(self, file=None, delim=None, quoting=QUOTING.RAW, encoding='utf-8', block_size=None):
+        if file is None:
+            file = sys.stdout
+
+        self.binary = not isinstance(file, io.TextIOBase)
+        self.encoding = encoding
+        self.quoting = quoting
+        self.__file = file
+        self.__block_size = block_size or WRITE_SIZE
+        self.__buffer = []
+        self.__size = 0
+        self.__newline = b'\n' if self.binary else '\n'
+
+        if self.binary and quoting != QUOTING.RAW:
+            raise ValueError('Only raw values can be written to a binary file')
+
+        self.setdelim(delim)
+        Writer.__writers.add(self)
+
+    def setdelim(self, delim):
+        '''Join the values of the rows written from now on with delim.'''
+
+        self.delim = delim
+
+        if delim is None:
+            self.__encode = None
+        elif self.binary:
+            self.__encode = delim.encode(self.encoding).join
+        else:
+            self.__encode = ENCODERS[self.quoting](delim)
+
+    def writerow(self, values):
+        line = self.__encode(values)
+
+        self.__buffer.append(line)
+        self.__buffer.append(self.__newline)
+        self.__size += len(line) + 1
+
+        if self.__size >= self.__block_size:
+            self.__drain()
+
+    def writerows(self, rows):
+        newline = self.__newline
+        text = newline.join(map(self.__encode, rows))
+
+        if rows:
+            self.__buffer.append(text)
+            self.__buffer.append(newline)
+            self.__size += len(text) + 1
+
+        if self.__size >= self.__block_size:
+            self.__drain()
+
+    def write(self, text):
+        self.__buffer.append(text)
+        self.__size += len(text)
+
+        if self.__size >= self.__block_size:
+            self.__drain()
+
+    def flush(self):
+        self.__drain()
+        self.__file.flush()
+
+    def __drain(self):
+        if self.__buffer:
+            self.__file.write(self.__newline[:0].join(self.__buffer))
+            self.__buffer = []
+            self.__size = 0
+
+    @staticmethod
+    def flush_all():
+        for writer in list(Writer.__writers):
+            writer.flush()
+
+        sys.stdout.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+
+def encode_raw(delim):
+    return delim.join
+
+
+def encode_strip(delim):
+    join = delim.join
+
+    def encode(values):
+        line = join(values)
+
+        # Only values with quotes have quotes to strip
+        if '"' not in line:
+            return line
+
+        return join(map(strip_value, values))
+
+    return encode
+
+
+def encode_always(delim):
+    join = delim.join
+    quoted_join = ('"%s"' % delim).join
+
+    def encode(values):
+        line = join(values)
+
+        # Values without quotes are quoted by quoting the whole row
+        if '"' not in line and values:
+            return '"%s"' % quoted_join(values)
+
+        return join(map(quote_value, values))
+
+    return encode
+
+
+def encode_auto(delim):
+    join = delim.join
+    is_numeric = NUMERIC_FIELD_RE.match
+
+    def encode(values):
+        line = join(values)
+
+        if '"' not in line:
+            return join([v if is_numeric(v) else '"%s"' % v for v in values])
+
+        return join(map(autoquote_value, values))
+
+    return encode
+
+
+def encode_minimal(delim):
+    join = delim.join
+
+    def encode(values):
+        line = join(values)
+
+        # A row with no quote, newline or delimiter in its values is written
+        # as it is.  Values with a delimiter add to the delimiters in the line.
+        if '"' not in line and '\n' not in line and delim and line.count(delim) == len(values) - 1:
+            return line
+
+        return join([minquote_value(v, delim) for v in values])
+
+    return encode
+
+
+# Row encoders of each QUOTING, by the delimiter
+ENCODERS = {
+    QUOTING.RAW     : encode_raw,
+    QUOTING.AUTO    : encode_auto,
+    QUOTING.MINIMAL : encode_minimal,
+    QUOTING.ALWAYS  : encode_always,
+    QUOTING.STRIP   : encode_strip,
+}
+
+
+##############################################################################
+# OUTPUT FILE
+
+class OutputFile(io.TextIOWrapper):
+    '''Write text to filename, in encoding (default that of sys.stdout),
+    through a binary buffer of WRITE_SIZE bytes.
+
+    A regular file is written as a temporary file in the same directory that
+    replaces filename when the OutputFile is closed, so a reader of filename
+    never sees it half written.  If the with block of the OutputFile raises,
+    the temporary file is removed instead.  Other files, such as /dev/null,
+    and any file if not atomic, are written in place.
+    '''
+
+    def __init__(self, filename, encoding=None, atomic=True):
+        if encoding is None:
+            encoding = sys.stdout.encoding
+
+        self.filename = filename
+        self.tempname = None
+        self.__path = os.path.realpath(filename)
+        self.__is_preallocated = False
+
+        if atomic and (os.path.isfile(self.__path) or not os.path.exists(self.__path)):
+            file = self.__create()
+        else:
+            file = open(self.__path, 'wb', buffering=WRITE_SIZE)
+
+        super().__init__(file, encoding=encoding, errors=sys.stdout.errors)
+
+    def __create(self):
+        dirname, basename = os.path.split(self.__path)
+        fd, self.tempname = tempfile.mkstemp(prefix='.%s.' % basename, dir=dirname)
+
+        # Keep the mode of the file replaced, or give the mode of a new file
+        try:
+            mode = os.stat(self.__path).st_mode & 0o7777
+        except FileNotFoundError:
+            umask = os.umask(0)
+            mode = 0o666 & ~umask
+            os.umask(umask)
+
+        os.fchmod(fd, mode)
+
+        return open(fd, 'wb', buffering=WRITE_SIZE)
+
+    def preallocate(self, size):
+        '''Reserve size bytes, the expected size of the file, ahead of the
+        writes if PREALLOCATE.  The file is cut to the size written when it is
+        closed.'''
+
+        if not PREALLOCATE or self.tempname is None or size <= 0 or not hasattr(os, 'posix_fallocate'):
+            return
+
+        try:
+            os.posix_fallocate(self.buffer.fileno(), 0, size)
+            self.__is_preallocated = True
+        except OSError as e:
+            pass
+
+    def close(self):
+        '''Write out the file and put it in place of filename.'''
+
+        if self.closed:
+            return
+
+        try:
+            if self.__is_preallocated:
+                self.flush()
+                self.buffer.truncate()
+
+            super().close()
+        except:
+            self.discard()
+            raise
+
+        if self.tempname is not None:
+            os.replace(self.tempname, self.__path)
+            self.tempname = None
+
+    def discard(self):
+        '''Close the file without putting it in place of filename.'''
+
+        try:
+            super().close()
+        except OSError as e:
+            pass
+        finally:
+            if self.tempname is not None:
+                os.unlink(self.tempname)
+                self.tempname = None
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class CompressedOutput(io.TextIOWrapper):
+    '''Write text to output, a text file such as sys.stdout or an OutputFile,
+    compressed with compression by a Compressor, in the encoding of output.
+
+    Closing the CompressedOutput closes output too, unless it is sys.stdout.
+    If the with block of the CompressedOutput raises, an OutputFile is
+    discarded.
+    '''
+
+    def __init__(self, output, compression):
+        output.flush()
+
+        self.output = output
+
+        super().__init__(io.BufferedWriter(Compressor(output.buffer, compression), WRITE_SIZE), encoding=output.encoding, errors=output.errors)
+
+    def close(self):
+        '''Write out the end of the compressed text and close output.'''
+
+        if self.closed:
+            return
+
+        try:
+            super().close()
+        except:
+            self.discard()
+            raise
+
+        if self.output is sys.stdout:
+            self.output.flush()
+        else:
+            self.output.close()
+
+    def discard(self):
+        '''Close the compressor, and discard output if it is an OutputFile.'''
+
+        try:
+            super().close()
+        except Exception as e:
+            pass
+        finally:
+            if isinstance(self.output, OutputFile):
+                self.output.discard()
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def open_output(filename=None, encoding=None, atomic=True, compression=None):
+    '''Open filename for writing as an OutputFile, treating None and '-' as
+    stdout, which stays open after the with block.  The output is compressed
+    with compression, as named in COMPRESSIONS, by a CompressedOutput if it
+    is given.'''
+
+    if filename is None or filename == '-':
+        output = sys.stdout
+    else:
+        output = OutputFile(filename, encoding, atomic)
+
+    if compression is not None:
+        try:
+            return CompressedOutput(output, compression)
+        except:
+            if output is not sys.stdout: output.discard()
+            raise
+
+    if output is sys.stdout:
+        return contextlib.nullcontext(output)
+
+    return output
+
+
+##############################################################################
+# BLOCK READER
+
+class BlockReader(object):
+    '''Read a file in large blocks and hand out its lines one at a time.
+
+    Each block is split into lines in one pass.  A line cut off at the end
+    of a block is carried over and completed by the next block.
+
+    If encoding is given, file is opened in binary mode and its lines are
+    handed to Reader as bytes in that encoding, with any carriage return
+    before the newline removed as text mode would.
+    '''
+
+    def __init__(self, file, block_size=BLOCK_SIZE, encoding=None):
+        self.binary = encoding is not None
+        self.encoding = encoding
+        self.__file = file
+        self.__block_size = block_size or BLOCK_SIZE
+
+        # nextline() returns the next line without the newline, or None at
+        # the end of the file.  Resuming a generator from C keeps the per-line
+        # cost below that of file.readline().
+        self.nextline = functools.partial(next, self.__lines(), None)
+
+    def seek(self, offset):
+        '''Continue reading from offset, a position in the file as returned
+        by its tell().'''
+
+        self.__file.seek(offset)
+        self.nextline = functools.partial(next, self.__lines(), None)
+
+    def __lines(self):
+        read = self.__file.read
+        size = self.__block_size
+        block = read(size)
+        is_binary = isinstance(block, bytes)
+        newline = b'\n' if is_binary else '\n'
+        cr = b'\r'
+        empty = block[:0]
+        partial = []
+
+        while block:
+            if newline not in block:
+                # The line is longer than a block
+                partial.append(block)
+                block = read(size)
+                continue
+
+            lines = block.split(newline)
+
+            if partial:
+                partial.append(lines[0])
+                lines[0] = empty.join(partial)
+
+            partial = [lines.pop()]
+
+            if is_binary and (cr in block or lines[0].endswith(cr)):
+                lines = [line[:-1] if line.endswith(cr) else line for line in lines]
+
+            yield from lines
+
+            block = read(size)
+
+        # Whatever is left over is the last line
+        tail = empty.join(partial)
+
+        if is_binary and tail.endswith(cr):
+            tail = tail[:-1]
+
+        if tail:
+            yield tail
+
+    def close(self):
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+##############################################################################
+# MAPPED READER
+
+class MappedReader(BlockReader):
+    '''Read a regular file through a memory map.
+
+    Lines are handed out as bytes in the given encoding, so a Reader splits
+    them into fields without decoding the file and decodes only the fields
+    that are used.  Use is_mappable() to check whether a file qualifies.
+    '''
+
+    def __init__(self, filename, encoding='utf-8', block_size=BLOCK_SIZE):
+        self.filename = filename
+        self.__index = None
+        self.__file = open(filename, 'rb')
+
+        try:
+            self.data = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        except:
+            self.__file.close()
+            raise
+
+        super().__init__(self.data, block_size, encoding)
+
+    def index(self):
+        '''The RowIndex of the file, built the first time it is needed.'''
+
+        if self.__index is None:
+            self.__index = RowIndex.open(self.filename, self.data)
+
+        return self.__index
+
+    def close(self):
+        super().close()
+        self.__file.close()
+
+    @staticmethod
+    def is_mappable(filename, encoding):
+        '''Whether filename is a non-empty regular file in an encoding that can
+        be split into fields before it is decoded.'''
+
+        return (
+            is_ascii_compatible(encoding)
+            and os.path.isfile(filename)
+            and os.path.getsize(filename) > 0
+        )
+
+
+##############################################################################
+# PARALLEL READER
+
+class ParallelReader(MappedReader):
+    '''Read a regular file through a memory map, splitting it into rows on
+    several processes.
+
+    The file is cut into chunks of about chunk_size bytes, each ending at the
+    first newline after which it holds an even number of quotes, so every
+    chunk is made of whole rows.  A pool of jobs processes splits the chunks
+    into rows, and nextline() hands them to Reader in their original order,
+    with any newlines inside quoted values in place.  Rows are found by
+    counting quotes, which agrees with Reader on well-formed files.
+    '''
+
+    def __init__(self, filename, jobs, encoding='utf-8', chunk_size=CHUNK_SIZE):
+        super().__init__(filename, encoding)
+
+        self.whole_rows = True
+        self.__jobs = jobs
+        self.__chunk_size = chunk_size
+        self.__pool = None
+        self.nextline = functools.partial(next, self.__rows(0), None)
+
+    def seek(self, offset):
+        '''Continue reading from offset, the start of a row.'''
+
+        self.nextline = functools.partial(next, self.__rows(offset), None)
+
+    def __rows(self, offset):
+        if self.__pool is None:
+            self.__pool = multiprocessing.Pool(self.__jobs)
+
+        pending = collections.deque()
+
+        for start, end in self.chunks(offset):
+            pending.append(self.__pool.apply_async(read_rows, (self.filename, start, end)))
+
+            # Keep every process busy without reading too far ahead
+            if len(pending) > 2 * self.__jobs:
+                yield from pending.popleft().get()
+
+        while pending:
+            yield from pending.popleft().get()
+
+    def chunks(self, pos=0, chunk_size=None):
+        '''The (start, end) offsets of the chunks of the file from pos, the
+        start of a row, each made of whole rows of about chunk_size bytes.'''
+
+        data = self.data
+        size = len(data)
+
+        if chunk_size is None:
+            chunk_size = self.__chunk_size
+
+        while pos < size:
+            end = data.find(b'\n', pos + chunk_size)
+            end = size if end < 0 else end + 1
+            quotes = data[pos:end].count(b'"')
+
+            # Carry on to the end of a row quoted across the cut
+            while quotes % 2 and end < size:
+                nextend = data.find(b'\n', end)
+                nextend = size if nextend < 0 else nextend + 1
+                quotes += data[end:nextend].count(b'"')
+                end = nextend
+
+            yield pos, end
+
+            pos = end
+
+    def close(self):
+        if self.__pool is not None:
+            self.__pool.terminate()
+
+        super().close()
+
+
+def read_rows(filename, start, end):
+    '''Return the rows of filename from offset start to offset end, both
+    the start of a row, as ParallelReader hands them out.'''
+
+    with open(filename, 'rb') as fo:
+        fo.seek(start)
+        block = fo.read(end - start)
+
+    lines = block.split(b'\n')
+
+    if block.endswith(b'\n'):
+        lines.pop()
+
+    if b'\r' in block:
+        lines = [line[:-1] if line.endswith(b'\r') else line for line in lines]
+
+    # As with BlockReader, an empty tail is not a line
+    if lines and not lines[-1] and not block.endswith(b'\n'):
+        lines.pop()
+
+    # Unless a quoted value spans lines, every line is a row of its own
+    if b'"' not in block or not any(map((1).__and__, map(bytes.count, lines, itertools.repeat(b'"')))):
+        return lines
+
+    rows = []
+    partial = []
+    inquote = False
+
+    for line in lines:
+        partial.append(line)
+
+        if line.count(b'"') % 2:
+            inquote = not inquote
+
+        if not inquote:
+            rows.append(b'\n'.join(partial))
+            partial = []
+
+    if partial:
+        rows.append(b'\n'.join(partial))
+
+    return rows
+
+
+##############################################################################
+# FOLLOWER
+
+class Follower(object):
+    '''Read a file as it grows, as tail -f does.
+
+    Lines are handed out once a newline completes them.  At the end of the
+    file, nextline() checks for more every interval seconds instead of
+    returning None, so a row whose quoted value is still being written is
+    read only once it is complete.  Every Writer, and standard output, is
+    flushed before waiting, so the output of the rows read so far is not
+    held back.
+
+    Lines are handed to Reader as bytes in the given encoding if the file
+    can be split into fields before it is decoded, as MappedReader does.
+    '''
+
+    def __init__(self, filename, encoding='utf-8', block_size=BLOCK_SIZE, interval=None):
+        self.binary = encoding is not None and is_ascii_compatible(encoding)
+        self.encoding = encoding if self.binary else None
+        self.__file = open(filename, 'rb')
+        self.__block_size = block_size or BLOCK_SIZE
+        self.__interval = FOLLOW_INTERVAL if interval is None else interval
+        self.__decode = None
+        self.__lines = collections.deque()
+        self.__partial = []
+
+        # Other encodings are decoded as they are read
+        if not self.binary:
+            self.__decode = codecs.getincrementaldecoder(encoding or 'utf-8')().decode
+
+        self.nextline = functools.partial(next, self.__follow(), None)
+
+    def ready(self):
+        '''Whether nextline() can return a line without waiting.'''
+
+        return bool(self.__lines) or self.__read()
+
+    def __follow(self):
+        lines = self.__lines
+
+        while True:
+            while lines:
+                yield lines.popleft()
+
+            if not self.__read():
+                Writer.flush_all()
+
+                while not self.__read():
+                    time.sleep(self.__interval)
+
+    def __read(self):
+        # Read up to the first block that completes a line, if any
+        newline, cr = ('\n', '\r') if self.__decode else (b'\n', b'\r')
+        partial = self.__partial
+
+        while True:
+            block = self.__file.read(self.__block_size)
+
+            if not block:
+                return False
+
+            if self.__decode:
+                block = self.__decode(block)
+
+            if newline not in block:
+                partial.append(block)
+                continue
+
+            lines = block.split(newline)
+            partial.append(lines[0])
+            lines[0] = block[:0].join(partial)
+            partial[:] = [lines.pop()]
+
+            # Carriage returns are removed as text mode would
+            self.__lines.extend(line[:-1] if line.endswith(cr) else line for line in lines)
+
+            return True
+
+    def close(self):
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+##############################################################################
+# PREFETCHER
+
+class Prefetcher(io.RawIOBase):
+    '''Read a binary file ahead of its reader in a background thread.
+
+    file is read block_size bytes at a time into a queue of at most depth
+    blocks.  The GIL is released during each read, so the reader parses one
+    block while the next ones are being read, without holding more than
+    depth blocks in memory.
+
+    stalls counts the blocks the reader had to wait for, and waits the
+    blocks the thread had to wait to queue because the reader was behind.
+    They are written to stderr on close if CSV_PREFETCH_STATS is set.
+    '''
+
+    def __init__(self, file, block_size=BLOCK_SIZE, depth=DECOMPRESS_DEPTH):
+        super().__init__()
+
+        self.blocks = 0
+        self.stalls = 0
+        self.waits = 0
+        self.__file = file
+        self.__block_size = block_size or BLOCK_SIZE
+        self.__queue = queue.Queue(max(depth, 1))
+        self.__block = b''
+        self.__pos = 0
+        self.__is_eof = False
+        self.__is_stopped = False
+        self.__thread = threading.Thread(target=self.__prefetch, daemon=True)
+        self.__thread.start()
+
+    def __prefetch(self):
+        read = self.__file.read
+        size = self.__block_size
+        put = self.__queue.put
+
+        try:
+            while not self.__is_stopped:
+                block = read(size)
+
+                try:
+                    put(block, block=False)
+                except queue.Full:
+                    self.waits += 1
+                    put(block)
+
+                if not block: break
+
+                self.blocks += 1
+        except Exception as e:
+            # Raised by the reader instead
+            put(e)
+        finally:
+            self.__file.close()
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        # Whole blocks are handed out without copying
+        if not self.__nextblock():
+            return b''
+
+        block = self.__block
+        pos = self.__pos
+
+        if size is None or size < 0:
+            size = len(block) - pos
+
+        self.__pos = pos + size
+
+        return block if pos == 0 and size >= len(block) else block[pos:pos+size]
+
+    def readinto(self, buf):
+        if not self.__nextblock():
+            return 0
+
+        block = self.__block
+        pos = self.__pos
+        size = min(len(buf), len(block) - pos)
+        buf[:size] = block[pos:pos+size]
+        self.__pos = pos + size
+
+        return size
+
+    def __nextblock(self):
+        # Whether there is more to read, waiting for the next block if needed
+        while self.__pos >= len(self.__block) and not self.__is_eof:
+            try:
+                block = self.__queue.get(block=False)
+            except queue.Empty:
+                self.stalls += 1
+                block = self.__queue.get()
+
+            if isinstance(block, Exception):
+                self.__is_eof = True
+                raise block
+
+            self.__block = block
+            self.__pos = 0
+            self.__is_eof = not block
+
+        return not self.__is_eof
+
+    def close(self):
+        if self.closed:
+            return
+
+        self.__is_stopped = True
+
+        # Unblock the thread if it is waiting for room in the queue
+        while self.__thread.is_alive():
+            try:
+                self.__queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+        if PREFETCH_STATS:
+            sys.stderr.write('%s: %d blocks read ahead, reader stalled %d times, read-ahead waited %d times\n' % (
+                type(self).__name__, self.blocks, self.stalls, self.waits
+            ))
+
+        super().close()
+
+
+class Decompressor(Prefetcher):
+    '''Decompress a file in a background thread.
+
+    file is a binary file object compressed with compression, as named in
+    COMPRESSIONS.  It is decompressed ahead of the reader as a Prefetcher
+    reads, on another core while the decompressor releases the GIL.
+    '''
+
+    def __init__(self, file, compression, block_size=BLOCK_SIZE, depth=DECOMPRESS_DEPTH):
+        self.__file = file
+
+        super().__init__(open_compressed(file, compression), block_size, depth)
+
+    def close(self):
+        super().close()
+        self.__file.close()
+
+
+class Compressor(io.RawIOBase):
+    '''Compress the bytes written to file, a binary file object, in a
+    background thread.
+
+    Blocks written are queued, at most depth at a time, for the thread to
+    compress with compression, as named in COMPRESSIONS, and write to file.
+    The compressors release the GIL, so the writer produces the next blocks
+    on one core while the last ones are compressed on another.  Closing the
+    Compressor writes out the end of the compressed stream, but does not
+    close file.
+    '''
+
+    def __init__(self, file, compression, depth=COMPRESS_DEPTH):
+        super().__init__()
+
+        self.__file = open_compressing(file, compression)
+        self.__queue = queue.Queue(max(depth, 1))
+        self.__error = None
+        self.__thread = threading.Thread(target=self.__compress, daemon=True)
+        self.__thread.start()
+
+    def __compress(self):
+        get = self.__queue.get
+        write = self.__file.write
+
+        try:
+            for block in iter(get, None):
+                write(block)
+
+            self.__file.close()
+        except Exception as e:
+            # Raised by the writer instead
+            self.__error = e
+
+            for block in iter(get, None):
+                pass
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        if self.__error is not None:
+            raise self.__error
+
+        # b may be a view of a buffer that is reused once written
+        block = bytes(b)
+        self.__queue.put(block)
+
+        return len(block)
+
+    def close(self):
+        if self.closed:
+            return
+
+        self.__queue.put(None)
+        self.__thread.join()
+
+        super().close()
+
+        if self.__error is not None:
+            raise self.__error
+
+
+def sniff_compression(head):
+    '''The compression of a file that starts with the bytes head, as named
+    in COMPRESSIONS, or None if it is not compressed.'''
+
+    for magic, compression in COMPRESSIONS:
+        if head.startswith(magic):
+            return compression
+
+    return None
+
+
+def open_compressed(file, compression):
+    '''Return a binary file object of the decompressed contents of file, a
+    binary file object compressed with compression.'''
+
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=file)
+    elif compression == 'bzip2':
+        return bz2.BZ2File(file)
+    elif compression == 'xz':
+        return lzma.LZMAFile(file)
+
+    # zstd is in the standard library since Python 3.14, and in the
+    # zstandard package before that
+    try:
+        return importlib.import_module('compression.zstd').ZstdFile(file)
+    except ImportError:
+        pass
+
+    try:
+        zstandard = importlib.import_module('zstandard')
+    except ImportError:
+        raise ImportError('Reading zstd files requires the zstandard module') from None
+
+    return zstandard.ZstdDecompressor().stream_reader(file, read_across_frames=True)
+
+
+def open_compressing(file, compression):
+    '''Return a binary file object that writes to file, a binary file object,
+    compressed with compression.  Closing it does not close file.'''
+
+    if compression == 'gzip':
+        return gzip.GzipFile(filename='', mode='wb', compresslevel=6, fileobj=file)
+    elif compression == 'bzip2':
+        return bz2.BZ2File(file, 'wb')
+    elif compression == 'xz':
+        return lzma.LZMAFile(file, 'wb')
+
+    # zstd compresses on several threads of its own where it can
+    try:
+        zstd = importlib.import_module('compression.zstd')
+    except ImportError:
+        pass
+    else:
+        workers = zstd.CompressionParameter.nb_workers
+        threads = min(os.cpu_count() or 1, workers.bounds()[1])
+
+        return zstd.ZstdFile(file, 'wb', options={workers: threads} if threads > 1 else None)
+
+    try:
+        zstandard = importlib.import_module('zstandard')
+    except ImportError:
+        raise ImportError('Writing zstd files requires the zstandard module') from None
+
+    return zstandard.ZstdCompressor(threads=-1).stream_writer(file, closefd=False)
+
+
+def smart_open(filename, encoding='utf-8', block_size=None, jobs=1, prefetch=None, follow=False):
+    '''Open filename for reading with Reader, treating '-' as stdin.
+
+    Files compressed with gzip, bzip2, xz or zstd, recognized by their first
+    bytes, are decompressed by a Decompressor.  Uncompressed regular files
+    are memory mapped, and split into rows on jobs processes if jobs is more
+    than 1.  If prefetch (default PREFETCH_DEPTH) is not 0, files that are
+    not split are instead read that many blocks ahead by a Prefetcher.
+    Other files are read as text, in blocks of block_size bytes if it is
+    given.  If follow is set, uncompressed files are read by a Follower as
+    they grow instead.
+    '''
+
+    if prefetch is None:
+        prefetch = PREFETCH_DEPTH
+
+    if filename == '-':
+        # Duplicate stdin so the caller can close it without closing stdin
+        fo = os.fdopen(os.dup(sys.stdin.fileno()), 'rb')
+        encoding = None
+    else:
+        fo = open(filename, 'rb')
+
+    # Peeking does not consume the first bytes of a pipe
+    compression = sniff_compression(fo.peek(8))
+
+    if compression is not None:
+        fo = Decompressor(fo, compression, block_size, prefetch or DECOMPRESS_DEPTH)
+    elif follow and filename != '-':
+        fo.close()
+
+        return Follower(filename, encoding, block_size)
+    elif filename != '-' and MappedReader.is_mappable(filename, encoding) and (jobs > 1 or not prefetch):
+        fo.close()
+
+        # Map regular files into memory and decode only the fields in use
+        if jobs > 1:
+            return ParallelReader(filename, jobs, encoding)
+
+        return MappedReader(filename, encoding, block_size)
+    elif prefetch:
+        fo = Prefetcher(fo, block_size, prefetch)
+
+    if isinstance(fo, Prefetcher):
+        # The bytes read ahead are split into fields before they are decoded
+        if encoding is not None and is_ascii_compatible(encoding):
+            return BlockReader(fo, block_size, encoding)
+
+        fo = io.BufferedReader(fo)
+
+    fo = io.TextIOWrapper(fo, encoding=encoding)
+
+    # Read in large blocks if requested
+    if block_size:
+        fo = BlockReader(fo, block_size)
+
+    return fo
+
+
+##############################################################################
+# ROW INDEX
+
+class RowIndex(object):
+    '''Byte offsets of every step-th row of a file and of the first row of
+    each table, so a Reader can start close to any row.
+
+    The index is saved next to the file as FILENAME.idx and rebuilt when
+    the size or modification time of the file changes.  Rows are found by
+    counting quotes, which agrees with Reader on well-formed files.
+    '''
+
+    VERSION = 1
+
+
+    def __init__(self, step=None):
+        self.step = step or INDEX_STEP
+        self.rowcount = 0
+        self.marks = []         # offset of every step-th row
+        self.tables = []        # (rownum, offset) of the first row of each table
+        self.stat = None        # (size, mtime) of the file indexed
+
+    def mark(self, rownum):
+        '''The number and offset of the nearest indexed row at or before
+        rownum.'''
+
+        num = min(rownum // self.step, len(self.marks) - 1)
+
+        return num * self.step, self.marks[num]
+
+    def table(self, rownum):
+        '''The number and offset of the first row of the table that
+        contains rownum.'''
+
+        num = bisect.bisect_right(self.tables, (rownum, float('inf'))) - 1
+
+        return self.tables[max(num, 0)]
+
+    def scan(self, data):
+        '''Index data, the bytes of a file.'''
+
+        step = self.step
+        size = len(data)
+        quotes = itertools.repeat(b'"')
+        is_odd = (1).__and__
+        marks = [0]
+        tables = [(0, 0)]
+        rownum = 0
+        inquote = False
+        pos = 0
+
+        while pos < size:
+            # A block of whole lines
+            end = data.find(b'\n', pos + BLOCK_SIZE)
+            end = size if end < 0 else end + 1
+            block = data[pos:end]
+            lines = block.split(b'\n')
+
+            if data[end-1:end] == b'\n':
+                lines.pop()
+
+            # Unless a quoted value spans lines or a line is empty, every line
+            # is a row of its own
+            if (
+                not inquote
+                and b'' not in lines
+                and b'\r' not in lines
+                and (b'"' not in block or not any(map(is_odd, map(bytes.count, lines, quotes))))
+            ):
+                for num in range(-rownum % step, len(lines), step):
+                    if rownum + num:
+                        marks.append(pos + sum(map(len, lines[:num])) + num)
+
+                rownum += len(lines)
+                pos = end
+                continue
+
+            for line in lines:
+                if not inquote:
+                    if rownum and not rownum % step:
+                        marks.append(pos)
+
+                    # An empty line ends the table
+                    if not line or line == b'\r':
+                        tables.append((rownum + 1, pos + len(line) + 1))
+
+                    rownum += 1
+
+                if b'"' in line and line.count(b'"') % 2:
+                    inquote = not inquote
+
+                pos += len(line) + 1
+
+        self.rowcount = rownum
+        self.marks = marks
+        self.tables = [t for t in tables if t[0] < rownum] or [(0, 0)]
+
+    def load(self, filename):
+        with open(filename) as fo:
+            data = json.load(fo)
+
+        if data.get('version') != self.VERSION or data.get('step') != self.step:
+            raise ValueError('Stale index -- "%s"' % filename)
+
+        self.rowcount = data['rowcount']
+        self.marks = data['marks']
+        self.tables = [tuple(t) for t in data['tables']]
+        self.stat = tuple(data['stat'])
+
+    def save(self, filename):
+        data = {
+            'version'  : self.VERSION,
+            'step'     : self.step,
+            'stat'     : self.stat,
+            'rowcount' : self.rowcount,
+            'marks'    : self.marks,
+            'tables'   : self.tables,
+        }
+
+        # Replace any old index in one step
+        with open(filename + '.tmp', 'w') as fo:
+            json.dump(data, fo)
+
+        os.replace(filename + '.tmp', filename)
+
+    @classmethod
+    def open(cls, filename, data, step=None):
+        '''Return the index of filename, whose bytes are data, loading it
+        from FILENAME.idx if it is up to date or building and saving it
+        otherwise.'''
+
+        st = os.stat(filename)
+        stat = (st.st_size, st.st_mtime_ns)
+        idxname = filename + '.idx'
+        index = cls(step)
+
+        try:
+            index.load(idxname)
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        if index.stat != stat:
+            index.scan(data)
+            index.stat = stat
+
+            # The index only saves time, so a directory that cannot be
+            # written to is not an error
+            try:
+                index.save(idxname)
+            except OSError:
+                pass
+
+        return index
+
+
+##############################################################################
+# COLUMN READER
+
+def read_columns(file, columns, dtypes=None, delim=None):
+    '''Read columns of the table in file straight into NumPy arrays, and
+    return them in a dict keyed by the items of columns.
+
+    columns are column names, or column numbers counting from 0.  dtypes
+    gives the NumPy dtype of each column, or None to use float64 if the
+    values in the first BATCH_ROWS rows are numeric, as autoquoted()
+    decides once their quotes are removed, and object otherwise.  Values
+    that are empty or not numeric are NaN in a floating point column, and
+    raise ValueError in an integer column.  Other columns hold the values
+    without their quotes, in fixed-width or object arrays.
+
+    NumPy is an optional dependency, needed only by this function.
+    '''
+
+    try:
+        np = importlib.import_module('numpy')
+    except ImportError:
+        raise ImportError('numpy is required to read columns') from None
+
+    if dtypes is None:
+        dtypes = [None] * len(columns)
+
+    reader = Reader(file, delim=delim, has_header=True)
+    schema = reader.header().schema()
+    colnums = [schema.index(c) if isinstance(c, str) else c for c in columns]
+    arrays = [ColumnArray(np, dtype) for dtype in dtypes]
+
+    for batch in reader.batches():
+        rows = batch.rows
+
+        # Empty lines are not rows of the table
+        if not all(rows):
+            batch = Batch(batch.start, [row for row in rows if row], batch.schema, batch.delim)
+
+        for array, num in zip(arrays, colnums):
+            array.extend(batch.column(num))
+
+    return {column: array.array() for column, array in zip(columns, arrays)}
+
+
+class ColumnArray(object):
+    '''The values of one column in a NumPy array of dtype, converted a
+    batch at a time.  The array is preallocated and doubled in size when it
+    fills up.  dtype None is decided by the first batch.'''
+
+    def __init__(self, np, dtype=None):
+        self.__np = np
+        self.__dtype = None if dtype is None else np.dtype(dtype)
+        self.__array = None
+        self.__count = 0
+
+    def extend(self, values):
+        np = self.__np
+
+        # A row too short to have the column has it empty
+        if None in values:
+            values = ['' if v is None else v for v in values]
+
+        # Only a batch with a quote in it needs its quotes removed
+        if '"' in ''.join(values):
+            values = list(map(strip_value, values))
+
+        if self.__dtype is None:
+            self.__dtype = self.__guess(values)
+
+        data = self.__convert(values)
+        array = self.__array
+        count = self.__count
+        size = count + len(data)
+
+        if array is None:
+            array = np.empty(max(size, BATCH_ROWS), data.dtype)
+        elif not np.can_cast(data.dtype, array.dtype):
+            array = array.astype(np.promote_types(array.dtype, data.dtype))
+
+        if size > len(array):
+            grown = np.empty(max(size, 2 * len(array)), array.dtype)
+            grown[:count] = array[:count]
+            array = grown
+
+        array[count:size] = data
+
+        self.__array = array
+        self.__count = size
+
+    def array(self):
+        '''The values added so far, in an array of their own size.'''
+
+        array = self.__array
+
+        if array is None:
+            return self.__np.empty(0, self.__dtype or object)
+
+        return array[:self.__count].copy()
+
+    def __len__(self):
+        return self.__count
+
+    def __guess(self, values):
+        np = self.__np
+        match = NUMERIC_FIELD_RE.match
+        numbers = [v for v in values if len(v)]
+
+        if numbers and all(map(match, numbers)):
+            return np.dtype(np.float64)
+
+        return np.dtype(object)
+
+    def __convert(self, values):
+        np = self.__np
+        dtype = self.__dtype
+        count = len(values)
+
+        if dtype.kind == 'f':
+            match = NUMERIC_FIELD_RE.match
+
+            if all(map(match, values)):
+                return np.fromiter(map(float, values), dtype, count)
+
+            return np.fromiter((float(v) if match(v) else np.nan for v in values), dtype, count)
+
+        if dtype.kind in 'iu':
+            return np.fromiter(map(int, values), dtype, count)
+
+        if dtype.kind == 'O':
+            data = np.empty(count, dtype)
+            data[:] = values
+
+            return data
+
+        return np.array(values, dtype)
+
+
+##############################################################################
+# CSV TOKENIZER
+
+class Tokenizer(object):
+    '''Split rows into raw fields in a single pass.
+
+    Each character is examined once: quoted fields are skipped over with
+    str.find, unquoted fields with a search for the next delimiter.  When a
+    line ends inside a quoted field, more lines are pulled from `readline`
+    and the field carries on where it left off, so a field spanning N lines
+    costs O(N) rather than one full-row regex match per line.
+
+    Well-formed input yields the same fields as the regex engine.  A quote
+    that does not open a field, or text after a closing quote, is kept as
+    part of the field rather than swallowing the rest of the file.
+
+    Fields are returned as offsets into the row's text; FieldList slices
+    them out when they are used.
+    '''
+
+    def __init__(self, delim_re):
+        if delim_re.match(delim_re.pattern[:0]):
+            raise ValueError('Delimiter must not match an empty string -- "%s"' % delim_re.pattern)
+
+        self.__delim_re = delim_re
+
+        # Patterns of a binary source tokenize bytes
+        if isinstance(delim_re.pattern, bytes):
+            self.__quote = b'"'
+            self.__newline = b'\n'
+        else:
+            self.__quote = '"'
+            self.__newline = '\n'
+
+    def tokenize(self, line, readline):
+        '''Return the text of the row starting with line, and the (start,
+        end) offsets of its fields within that text.'''
+
+        search = self.__delim_re.search
+        dquote = self.__quote
+        lines = [line]
+        bounds = []
+        offset = 0          # offset of line within the row
+        start = 0           # offset of the field within the row
+
+        while True:
+            pos = start - offset
+
+            # Quoted field, possibly continuing over multiple lines
+            if line.startswith(dquote, pos):
+                pos += 1
+
+                while True:
+                    quote = line.find(dquote, pos)
+
+                    if quote < 0:
+                        nextline = readline()
+
+                        if nextline is None:
+                            pos = len(line)
+                            break
+
+                        offset += len(line) + 1
+                        line = nextline
+                        lines.append(line)
+                        pos = 0
+                    elif line.startswith(dquote, quote + 1):
+                        pos = quote + 2
+                    else:
+                        pos = quote + 1
+                        break
+
+            # Anything up to the next delimiter belongs to this field
+            match = search(line, pos)
+
+            if match is None:
+                bounds.append((start, offset + len(line)))
+                break
+
+            bounds.append((start, offset + match.start()))
+            start = offset + match.end()
+
+        if len(lines) > 1:
+            line = self.__newline.join(lines)
+
+        return line, bounds
+
+    def fieldbounds(self, buf, start=0, limit=None):
+        '''Return the (start, end) offsets of the fields of the complete row
+        in buf from offset start, as the regex engine splits it, and the
+        offset of the next field, or None after the last field.  At most
+        limit fields are returned if limit is given.
+
+        The offsets are found in one quote-aware scan of the buffer.  A field
+        that cannot be parsed, such as a stray quote or text after a closing
+        quote, runs to the end of the buffer.
+        '''
+
+        delim_re = self.__delim_re
+        newline = self.__newline
+        dquote = self.__quote
+        bufsize = len(buf)
+        bounds = []
+
+        while True:
+            end = bufsize
+            match = None
+
+            if buf.startswith(dquote, start):
+                quote = buf.find(dquote, start + 1)
+
+                while quote >= 0 and buf.startswith(dquote, quote + 1):
+                    quote = buf.find(dquote, quote + 2)
+
+                if quote >= 0:
+                    match = delim_re.match(buf, quote + 1)
+
+                    if match is not None:
+                        end = match.start()
+                    elif quote + 1 == bufsize:
+                        end = bufsize
+            else:
+                match = delim_re.search(buf, start)
+
+                if match is not None:
+                    end = match.start()
+
+                if buf.find(dquote, start, end) >= 0 or buf.find(newline, start, end) >= 0:
+                    match = None
+                    end = bufsize
+
+            bounds.append((start, end))
+
+            if match is None or end == bufsize:
+                return bounds, None
+
+            start = match.end()
+
+            if len(bounds) == limit:
+                return bounds, start
+
+
+##############################################################################
+# FIELD LIST
+
+class FieldList(object):
+    '''A read-only list of the fields of one row.
+
+    Only the text of the row is kept.  Unless bounds are given, the offsets
+    of its fields are found as far as the fields being asked for, and each
+    field is sliced out, and decoded if encoding is given, on first use.
+    '''
+
+    def __init__(self, buf, bounds, tokenizer, encoding=None):
+        self.__buf = buf
+        self.__tokenizer = tokenizer
+        self.__values = {}
+        self.encoding = encoding
+
+        # Offset of the next field to find, if any
+        if bounds is None:
+            self.__bounds = []
+            self.__next = 0 if len(buf) else None
+        else:
+            self.__bounds = bounds
+            self.__next = None
+
+    def __findbounds(self, count=None):
+        # The offsets of the first count fields, or of all fields
+        bounds = self.__bounds
+
+        if self.__next is not None and (count is None or count > len(bounds)):
+            limit = None if count is None else count - len(bounds)
+            found, self.__next = self.__tokenizer.fieldbounds(self.__buf, self.__next, limit)
+            bounds += found
+
+        return bounds
+
+    def __bound(self, num):
+        if num < 0:
+            num += len(self)
+
+        bounds = self.__findbounds(num + 1)
+
+        if num < 0 or num >= len(bounds):
+            raise IndexError('list index out of range')
+
+        return num, bounds[num]
+
+    def has(self, num):
+        '''Whether there is a field at num, a non-negative index.'''
+
+        return num < len(self.__findbounds(num + 1))
+
+    def index(self, value):
+        for num, v in enumerate(self):
+            if v == value:
+                return num
+
+        raise ValueError('%r is not in list' % (value,))
+
+    def encoded(self, num=None):
+        '''The field at num, or all fields, as read from the source.'''
+
+        buf = self.__buf
+
+        if num is None:
+            return [buf[start:end] for start, end in self.__findbounds()]
+
+        num, (start, end) = self.__bound(num)
+
+        return buf[start:end]
+
+    def as_list(self):
+        return [self[num] for num in range(len(self))]
+
+    def pick(self, nums, default=None, encoded=False):
+        '''The fields at nums, or default for a negative num or one past the
+        last field.  Each is sliced straight from its offsets, and decoded
+        unless encoded, without being kept.'''
+
+        buf = self.__buf
+        bounds = self.__findbounds(max(nums, default=-1) + 1)
+        count = len(bounds)
+        encoding = None if encoded else self.encoding
+        values = []
+
+        for num in nums:
+            if 0 <= num < count:
+                start, end = bounds[num]
+                value = buf[start:end]
+
+                if encoding is not None:
+                    value = value.decode(encoding)
+
+                values.append(value)
+            else:
+                values.append(default)
 
-        self.__reset()
+        return values
 
-    def __reset(self):
-        self.__rownum = 0
-        self.__firstrow = None
-        self.__is_sot = False
+    def __len__(self):
+        return len(self.__findbounds())
 
-        if self.__init_delim is None:
-            self.__delim = None
-            self.__row_re = None
-            self.__field_re = None
-            self.__delim_re = None
-        else:
-            self.__setdelim(self.__init_delim, len(self.__init_delim) > 1)
+    def __getitem__(self, num):
+        if isinstance(num, slice):
+            return [self[i] for i in range(*num.indices(len(self)))]
 
-        if self.__has_header:
-            self.__readrow()
+        value = self.__values.get(num)
 
-    def header(self):
-        if self.__has_header and self.__is_sot:
-            self.__readrow()
+        if value is None:
+            num, (start, end) = self.__bound(num)
+            value = self.__buf[start:end]
 
-        return self.__firstrow
+            if self.encoding is not None:
+                value = value.decode(self.encoding)
 
-    def next(self):
-        return self.__readrow()
+            self.__values[num] = value
 
-    def __next__(self):
-        return self.__readrow()
+        return value
 
     def __iter__(self):
-        while True:
-            row = self.__readrow()
-            if row is None: break
+        for num in range(len(self)):
+            yield self[num]
 
-            yield row
+    def __eq__(self, other):
+        return list(self) == list(other)
 
-    def __readrow(self):
-        gotline = False
-        row = None
-        buf = ''
+    def __repr__(self):
+        return repr(list(self))
 
-        # reset at the start of a new table
-        if self.__is_sot:
-            self.__reset()
 
-        while True:
-            line = self.__readline()
-            if line is None: break
+class SplitFieldList(FieldList):
+    '''A FieldList of a row without quotes, already split on its delimiter.
+    Each field is decoded, if encoding is given, on first use.'''
 
-            if gotline: buf += '\n'
-            buf += line
+    def __init__(self, fields, encoding=None):
+        self.__fields = fields
+        self.__values = {}
+        self.encoding = encoding
 
-            gotline = True
+    def has(self, num):
+        return num < len(self.__fields)
 
-            if self.__is_validrow(buf): break
+    def as_list(self):
+        encoding = self.encoding
 
-        if gotline:
-            values = self.__split(buf) if len(buf) else []
-            header = self.__firstrow
+        if encoding is None:
+            return list(self.__fields)
 
-            # empty line starts a new table on next reading
-            if len(values) == 0 and self.__is_multitable:
-                self.__is_sot = True
+        return [field.decode(encoding) for field in self.__fields]
 
-            # current row becomes the header if header not already set
-            if header is None and self.__has_header:
-                header = Row(self.__rownum, header, values, self.__delim)
+    def encoded(self, num=None):
+        if num is None:
+            return list(self.__fields)
 
-            row = Row(self.__rownum, header, values, self.__delim)
-            self.__rownum += 1
+        return self.__fields[num]
 
-            if self.__firstrow is None and self.__has_header:
-                self.__firstrow = row
+    def pick(self, nums, default=None, encoded=False):
+        fields = self.__fields
+        count = len(fields)
+        encoding = None if encoded else self.encoding
 
-        return row
+        if encoding is None:
+            return [fields[num] if 0 <= num < count else default for num in nums]
 
-    def __readline(self):
-        line = self.__file.readline()
+        return [fields[num].decode(encoding) if 0 <= num < count else default for num in nums]
 
-        if line == '':
-            line = None
-        else:
-            line = line.rstrip('\n')
+    def __len__(self):
+        return len(self.__fields)
 
-        if self.__delim is None and line is not None:
-            self.__guessdelim(line)
+    def __getitem__(self, num):
+        if isinstance(num, slice):
+            return [self[i] for i in range(*num.indices(len(self)))]
 
-        return line
+        if self.encoding is None:
+            return self.__fields[num]
 
-    def __guessdelim(self, buf):
-        delims = DELIMS.encode().decode('unicode_escape')
-        best_delim = None
-        best_count = 0
-        
-        for d in delims:
-            count = buf.count(d)
-
-            if count > best_count:
-                best_delim = d
-                best_count = count
-
-        if best_delim is None:
-            sys.stderr.write('Unable to guess the delimiter, please specify one with --delim\n')
-            sys.exit(1)
-        else:
-            self.__setdelim(best_delim)
+        value = self.__values.get(num)
 
-    def __setdelim(self, delim, is_regex=False):
-        delim_re = delim if is_regex else re.escape(delim)
-        unquoted_field_r = r'(?:(?!(?:%s)|").)*' % delim_re
-        quoted_field_r = r'"(?:[^"]|"")*"'
-        field_r = r'(?:%s)|(?:%s)' % (unquoted_field_r, quoted_field_r)
-        row_r = r'(?:%s)(?:(?:%s)(?:%s))*' % (field_r, delim_re, field_r)
-        row_re = re.compile(r'^(%s)$' % row_r)
-        field_re = re.compile(r'^(%s)$' % field_r)
+        if value is None:
+            value = self.__values[num] = self.__fields[num].decode(self.encoding)
 
-        self.__delim = delim
-        self.__row_re = row_re
-        self.__field_re = field_re
-        self.__delim_re = re.compile(delim_re)
+        return value
 
-    def __is_validrow(self, buf):
-        return self.__row_re.match(buf)
-
-    def __split(self, buf):
-        rawfields = self.__delim_re.split(buf)
-        fields = []
-        last = ''
-
-        for f in rawfields:
-            if len(last):
-                last += self.__delim + f
-
-                if self.__field_re.match(last):
-                    fields.append(last)
-                    last = ''
-            elif self.__field_re.match(f):
-                fields.append(f)
-            else:
-                last = f
 
-        if len(last):
-            fields.append(last)
+##############################################################################
+# HELPERS
+
+def guess_delim(lines, encoding=None):
+    '''Guess the delimiter of the table that starts with lines.
 
-        return fields
+    Each character in DELIMS is counted outside quoted fields on each row.
+    The character found the same number of times on the most rows wins,
+    then the one found the most times, then the earlier one in DELIMS.
+    lines are bytes in encoding if it is given.  Raise
+    DelimiterNotFoundException if no character is found at all.
+    '''
+
+    if encoding is None:
+        rows = re.sub(r'"[^"]*"', '', '\n'.join(lines)).split('\n')
+    else:
+        rows = re.sub(rb'"[^"]*"', b'', b'\n'.join(lines)).split(b'\n')
+
+    rows = [r for r in rows if len(r)]
+    best_delim = None
+    best_score = None
+
+    for d in GUESS_DELIMS:
+        target = d if encoding is None else d.encode(encoding)
+        counts = collections.Counter(r.count(target) for r in rows)
+        counts.pop(0, None)
+
+        if not counts:
+            continue
+
+        score = max((rowcount, count) for count, rowcount in counts.items())
+
+        if best_score is None or score > best_score:
+            best_delim = d
+            best_score = score
+
+    if best_delim is None:
+        raise DelimiterNotFoundException('Unable to guess the delimiter')
+
+    return best_delim
+
+
+def is_ascii_compatible(encoding):
+    '''Whether text in encoding can be split on the quote, newline and
+    delimiters before it is decoded.'''
+
+    try:
+        name = codecs.lookup(encoding).name
+    except LookupError:
+        return False
+
+    return name.startswith(ASCII_ENCODINGS) and name != 'utf-8-sig'
+
+
+def encoded_output(file, output=None):
+    '''Return the binary buffer of output (default sys.stdout) if the rows
+    read from file can be written to it as undecoded bytes, or None if they
+    must be written as text.
+
+    That is the case when file is a binary source such as MappedReader and
+    output expects the same encoding.  Any text already written to output
+    is flushed so the bytes come out in order.
+    '''
+
+    if output is None:
+        output = sys.stdout
+
+    if not getattr(file, 'binary', False) or not hasattr(output, 'buffer'):
+        return None
+
+    try:
+        if codecs.lookup(file.encoding).name != codecs.lookup(output.encoding).name:
+            return None
+    except (LookupError, TypeError):
+        return None
+
+    output.flush()
+
+    return output.buffer
+
+
+def parse_size(string):
+    '''Convert a size such as 512, 64K, 4M or 1G to the number of bytes.'''
+
+    match = re.match(r'^\s*([0-9]+)\s*([KMG]?)i?B?\s*$', string, re.I)
+
+    if not match or int(match.group(1)) == 0:
+        raise ValueError('Invalid size -- "%s"' % string)
+
+    return int(match.group(1)) * SIZE_UNITS[match.group(2).upper()]
 
 
 ##############################################################################
 # CSV ROW
 
+class Schema(object):
+    '''The header of a table, shared by all of its rows.
+
+    The names of the columns are read from the header once, and looked up
+    by name in a dict.  A schema does not change once it is made.
+    '''
+
+    __slots__ = ('__header', '__names', '__columns')
+
+    def __init__(self, header):
+        names = tuple(header.as_list())
+        columns = {}
+
+        # The first of two columns of the same name wins, as in list.index()
+        for num, name in enumerate(names):
+            columns.setdefault(name, num)
+
+        self.__header = header
+        self.__names = names
+        self.__columns = columns
+
+    def header(self):
+        return self.__header
+
+    def name(self, num):
+        '''The name of column num, or None if the header has no such column.'''
+
+        names = self.__names
+
+        return names[num] if 0 <= num < len(names) else None
+
+    def index(self, name):
+        num = self.__columns.get(name)
+
+        if num is None:
+            raise ValueError('%r is not in list' % (name,))
+
+        return num
+
+    def as_list(self):
+        return list(self.__names)
+
+    def __len__(self):
+        return len(self.__names)
+
+
 class Row(object):
+    '''One row of a table.  header is the Schema of the table, or its header
+    Row, or None if the table has no header.'''
+
+    __slots__ = ('__rownum', '__schema', '__values', '__delim')
+
     def __init__(self, rownum, header, values, delim):
+        if isinstance(header, Row):
+            header = Schema(header)
+
         self.__rownum = rownum
-        self.__header = header
+        self.__schema = header
         self.__values = values
         self.__delim = delim
 
     def header(self):
-        return self.__header
+        schema = self.__schema
+
+        return schema.header() if schema is not None else None
+
+    def schema(self):
+        return self.__schema
 
     def delim(self):
         return self.__delim
@@ -198,54 +2355,108 @@ class Row(object):
         return self.__rownum
 
     def as_list(self):
-        return self.__values
+        values = self.__values
 
-    def as_stripped_list(self):
-        stripped = []
+        if isinstance(values, FieldList):
+            return values.as_list()
 
-        for v in self.__values:
-            stripped.append(Value(v).stripped())
+        return values
 
-        return stripped
+    def as_bytes_list(self):
+        '''The values as bytes, undecoded if they were read from a binary
+        source such as MappedReader and UTF-8 encoded otherwise.'''
 
-    def as_quoted_list(self):
-        quoted = []
+        values = self.__values
 
-        for v in self.__values:
-            quoted.append(Value(v).quoted())
+        if isinstance(values, FieldList) and values.encoding is not None:
+            return values.encoded()
 
-        return quoted
+        return [v.encode() for v in values]
 
-    def as_autoquoted_list(self):
-        quoted = []
+    def value(self, key, default=None):
+        '''The raw value in column key, or default if there is none.  Unlike
+        row[key], only that one value is materialized.'''
+
+        num = self.colnum(key)
+
+        return default if num is None else self.__values[num]
+
+    def bytes_value(self, key, default=None):
+        '''The value in column key as bytes, as in as_bytes_list().'''
+
+        values = self.__values
+        num = self.colnum(key)
+
+        if num is None:
+            return default
 
-        for v in self.__values:
-            quoted.append(Value(v).autoquoted())
+        if isinstance(values, FieldList) and values.encoding is not None:
+            return values.encoded(num)
 
-        return quoted
+        return values[num].encode()
+
+    def pick(self, colnums, default=None, encoded=False):
+        '''The raw values in columns colnums, counting from 0, or default for
+        a negative colnum or one past the end of the row.  Only those values
+        are materialized.  They are bytes, as in as_bytes_list(), if encoded.'''
+
+        values = self.__values
+        is_binary = isinstance(values, FieldList) and values.encoding is not None
+
+        if isinstance(values, FieldList):
+            picked = values.pick(colnums, default, encoded and is_binary)
+        else:
+            count = len(values)
+            picked = [values[num] if 0 <= num < count else default for num in colnums]
+
+        if encoded and not is_binary:
+            picked = [v.encode() if isinstance(v, str) else v for v in picked]
+
+        return picked
+
+    def as_stripped_list(self):
+        return [strip_value(v) for v in self.__values]
+
+    def as_quoted_list(self):
+        return [quote_value(v) for v in self.__values]
+
+    def as_autoquoted_list(self):
+        return [autoquote_value(v) for v in self.__values]
 
     def as_minquoted_list(self, delim=None):
         delim = self.__delim
-        quoted = []
-
-        for v in self.__values:
-            quoted.append(Value(v).minquoted(delim))
 
-        return quoted
+        return [minquote_value(v, delim) for v in self.__values]
 
     def as_strquoted_list(self, delim=None):
         delim = self.__delim
-        quoted = []
 
-        for v in self.__values:
-            quoted.append(Value(v).strquoted(delim))
+        return [strquote_value(v, delim) for v in self.__values]
+
+    def iter_values(self):
+        '''The raw values, without making a Cell for each.'''
+
+        return iter(self.__values)
 
-        return quoted
+    def stripped_values(self):
+        '''The values without their quotes, as an iterator.'''
+
+        return map(strip_value, self.__values)
+
+    def cells(self, view=False):
+        '''The cells of the row, as iter(row) does.  If view is true, one
+        CellView is moved from cell to cell instead of making a Cell for
+        each, so it must not be kept past the next cell.'''
+
+        if view:
+            return iter(CellView(self.__rownum, self.__schema, self.__values))
+
+        return iter(self)
 
     def as_dict(self):
         mydict = dict()
         values = self.__values
-        header = self.__header.as_list() if self.__header else []
+        header = self.__schema.as_list() if self.__schema else []
         colcount = max(len(values), len(header))
 
         for num in range(colcount):
@@ -262,33 +2473,55 @@ class Row(object):
     def __len__(self):
         return len(self.__values)
 
-    def __getitem__(self, key):
-        header = self.__header
-        values = self.__values
-        cell = None
+    def is_empty(self):
+        '''Whether the row is an empty line, without splitting it.'''
+
+        return not self.__hascol(0)
+
+    def colnum(self, key):
+        schema = self.__schema
+        colnum = None
 
         if isinstance(key, slice):
             raise Exception('Slice is not supported')
         elif isinstance(key, str):
-            num = header.index(key)
+            num = schema.index(key)
         else:
             num = key
 
         if num < 0:
-            num += len(header)
+            num += len(schema)
 
-        if 0 <= num and num < len(values):
-            name = header[num].value() if header and header[num] else None
-            val = values[num] if num < len(values) else None
-            cell = Cell(self.__rownum, name, num, val)
+        if 0 <= num and self.__hascol(num):
+            colnum = num
+
+        return colnum
+
+    def __hascol(self, num):
+        values = self.__values
+
+        if isinstance(values, FieldList):
+            return values.has(num)
+
+        return num < len(values)
+
+    def __getitem__(self, key):
+        schema = self.__schema
+        values = self.__values
+        num = self.colnum(key)
+        cell = None
+
+        if num is not None:
+            name = schema.name(num) if schema is not None else None
+            cell = Cell(self.__rownum, name, num, values[num])
 
         return cell
 
     def __iter__(self):
-        header = self.__header
+        schema = self.__schema
 
         for num, val in enumerate(self.__values):
-            name = header[num].value() if header and num < len(header) else None
+            name = schema.name(num) if schema is not None else None
 
             yield Cell(self.__rownum, name, num, val)
 
@@ -296,6 +2529,49 @@ class Row(object):
         return self.__delim.join(self.__values)
 
 
+class Batch(object):
+    '''Consecutive rows of one table, by row and by column.  rows holds the
+    raw values of each row, numbered from start as Row.rownum() numbers
+    them.  schema is the Schema of the table, or None if it has no header.'''
+
+    __slots__ = ('start', 'rows', 'schema', 'delim', '__columns')
+
+    def __init__(self, start, rows, schema, delim):
+        self.start = start
+        self.rows = rows
+        self.schema = schema
+        self.delim = delim
+        self.__columns = None
+
+    def rownums(self):
+        return range(self.start, self.start + len(self.rows))
+
+    def columns(self):
+        '''The values of each column, as tuples as long as the batch.  A
+        row too short to have a column has None in it.'''
+
+        if self.__columns is None:
+            self.__columns = list(itertools.zip_longest(*self.rows))
+
+        return self.__columns
+
+    def column(self, num):
+        columns = self.columns()
+
+        if num < len(columns):
+            return columns[num]
+
+        return (None,) * len(self.rows)
+
+    def head(self, count):
+        '''A Batch of the first count rows.'''
+
+        return Batch(self.start, self.rows[:count], self.schema, self.delim)
+
+    def __len__(self):
+        return len(self.rows)
+
+
 ##############################################################################
 # CSV CELL
 
@@ -337,85 +2613,156 @@ class Cell(object):
         return self.__value.raw()
 
 
+class CellView(object):
+    '''A Cell that moves along the values of a row as it is iterated.'''
+
+    __slots__ = ('__rownum', '__schema', '__values', '__colnum', '__value')
+
+    def __init__(self, rownum, schema, values):
+        self.__rownum = rownum
+        self.__schema = schema
+        self.__values = values
+        self.__colnum = None
+        self.__value = None
+
+    def __iter__(self):
+        for num, value in enumerate(self.__values):
+            self.__colnum = num
+            self.__value = value
+
+            yield self
+
+    def stripped(self):
+        return strip_value(self.__value)
+
+    def quoted(self):
+        return quote_value(self.__value)
+
+    def autoquoted(self):
+        return autoquote_value(self.__value)
+
+    def minquoted(self, delim):
+        return minquote_value(self.__value, delim)
+
+    def strquoted(self, delim):
+        return strquote_value(self.__value, delim)
+
+    def colname(self):
+        schema = self.__schema
+
+        return schema.name(self.__colnum) if schema is not None else None
+
+    def colnum(self):
+        return self.__colnum
+
+    def rownum(self):
+        return self.__rownum
+
+    def value(self):
+        return self.__value
+
+    def __str__(self):
+        return self.__value
+
+
 ##############################################################################
 # CSV VALUE
 
-class Value(object):
-    __quoted_field_re = re.compile(r'^"((?:[^"]|""|\s)*)"$')
-    __numeric_field_re = re.compile(r'^([-+]?[0-9]+|[-+]?[0-9]*\.[0-9]+|[-+]?Inf|NaN)$')
+QUOTED_FIELD_RE = re.compile(r'^"((?:[^"]|""|\s)*)"$')
+NUMERIC_FIELD_RE = re.compile(r'^([-+]?[0-9]+|[-+]?[0-9]*\.[0-9]+|[-+]?Inf|NaN)$')
 
-    def __init__(self, raw_value):
-        self.__raw = raw_value
-        self.__rawstr = str(raw_value)
-        self.__quoted = None
-        self.__stripped = None
-        self.__is_quoted_v = None
-        self.__is_numeric_v = None
 
-        if raw_value is None:
-            self.__rawstr = ''
+def strip_value(raw):
+    '''raw without its quotes, as Value(raw).stripped() but without making
+    a Value.'''
+
+    if raw is None:
+        return ''
+
+    rawstr = str(raw)
+
+    # Only a value that starts with a quote can be quoted
+    match = QUOTED_FIELD_RE.match(rawstr) if rawstr.startswith('"') else None
+
+    if match is None:
+        return rawstr
+
+    return (match.group(1) + rawstr[match.end():]).replace('""', '"')
+
+
+def quote_value(raw):
+    '''raw in quotes, as Value(raw).quoted().'''
+
+    if raw is None:
+        return ''
 
-    def __is_quoted(self):
-        if self.__is_quoted_v is None:
-            self.__is_quoted_v = self.__quoted_field_re.match(self.__rawstr)
+    rawstr = str(raw)
 
-        return self.__is_quoted_v
+    if rawstr.startswith('"') and QUOTED_FIELD_RE.match(rawstr):
+        return rawstr
 
-    def __is_numeric(self):
-        if self.__is_numeric_v is None:
-            self.__is_numeric_v = self.__numeric_field_re.match(self.__rawstr)
+    return '"%s"' % rawstr.replace('"', '""')
 
-        return self.__is_numeric_v
+
+def autoquote_value(raw):
+    '''raw stripped if it is numeric and quoted otherwise, as
+    Value(raw).autoquoted().'''
+
+    if NUMERIC_FIELD_RE.match('' if raw is None else str(raw)):
+        return strip_value(raw)
+
+    return quote_value(raw)
+
+
+def minquote_value(raw, delim):
+    '''raw quoted only if it needs to be, as Value(raw).minquoted(delim).'''
+
+    value = strip_value(raw)
+
+    if '"' in value or delim in value or '\n' in value:
+        value = quote_value(raw)
+
+    return value
+
+
+def strquote_value(raw, delim):
+    '''raw quoted only if it is a string, as Value(raw).strquoted(delim).'''
+
+    if isinstance(raw, str):
+        return quote_value(raw)
+
+    return '' if raw is None else str(raw)
+
+
+class Value(object):
+    def __init__(self, raw_value):
+        self.__raw = raw_value
+        self.__quoted = None
+        self.__stripped = None
 
     def stripped(self):
         if self.__stripped is None:
-            self.__stripped = self.__rawstr
-
-            if self.__is_quoted():
-                self.__stripped = self.__quoted_field_re.sub(r'\1', self.__rawstr)
-                self.__stripped = self.__stripped.replace('""', '"')
+            self.__stripped = strip_value(self.__raw)
 
         return self.__stripped
 
     def quoted(self):
         if self.__quoted is None:
-            self.__quoted = self.__rawstr
-
-            if not self.__is_quoted() and self.__raw is not None:
-                self.__quoted = self.__rawstr.replace('"', '""')
-                self.__quoted = ('"%s"' % self.__quoted)
+            self.__quoted = quote_value(self.__raw)
 
         return self.__quoted
 
     def autoquoted(self):
-        value = None
-
-        if self.__is_numeric():
-            value = self.stripped()
-        else:
-            value = self.quoted()
-
-        return value
+        return autoquote_value(self.__raw)
 
     def minquoted(self, delim):
-        value = self.stripped()
-
-        if '"' in value or delim in value or '\n' in value:
-            value = self.quoted()
-
-        return value
+        return minquote_value(self.__raw, delim)
 
     def strquoted(self, delim):
-        value = self.__rawstr
-
-        if isinstance(self.__raw, str):
-            value = self.quoted()
-
-        return value
+        return strquote_value(self.__raw, delim)
 
     def raw(self):
         return self.__raw
 
     def __str__(self):
-        return self.__rawstr
-
+        return '' if self.__raw is None else str(self.__raw)
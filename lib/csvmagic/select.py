@@ -0,0 +1,418 @@
+"""Field selectors for picking columns out of csv rows.
+
+https://github.com/markuskimius/csvmagic
+"""
+
+import re
+from csvmagic import libcsv
+
+__copyright__ = 'Copyright 2019-2025 Mark Kim'
+__license__ = 'Apache 2.0'
+__version__ = '2.4.0'
+__author__ = 'Mark Kim'
+
+
+##############################################################################
+# PARSER
+
+FIELD_RE = r'^((?P<COLNO>[-+]?[0-9]+)|(?P<RANGE>(?P<START>[-+]?[0-9]+)[-](?P<END>([-+]?[0-9]+)?))|(?P<VMOD>[~])?[/](?P<REGEX>([^\\/]|\\.)+)[/](?P<MOD>[i]*)|(?P<REST>[-])|=(?P<COLNAME>.+))$'
+FIELD_RC = re.compile(FIELD_RE)
+
+
+def parse_fieldselector(string, by_value=False):
+    '''The list of FieldSelectors in string, a comma separated list of field
+    criteria.  ~/REGEX/ selects the values matching REGEX if by_value is
+    true, and is a column name otherwise.'''
+
+    parts = string.split(',')
+
+    for i, p in enumerate(parts):
+        match = FIELD_RC.search(p)
+
+        if not match:
+            parts[i] = FieldSelectorByColumnName(p)
+        elif match.group('COLNO'):
+            value = match.group('COLNO')
+            parts[i] = FieldSelectorByColumnNumber(int(value))
+        elif match.group('RANGE'):
+            start = None if match.group('START') == '' else int(match.group('START'))
+            end = None if match.group('END') == '' else int(match.group('END'))
+            parts[i] = FieldSelectorByColumnRange(start, end)
+        elif match.group('VMOD') and not by_value:
+            parts[i] = FieldSelectorByColumnName(p)
+        elif match.group('VMOD'):
+            regex = match.group('REGEX')
+            mod = match.group('MOD')
+            parts[i] = FieldSelectorByValueRegex(regex, mod)
+        elif match.group('REGEX'):
+            regex = match.group('REGEX')
+            mod = match.group('MOD')
+            parts[i] = FieldSelectorByColumnRegex(regex, mod)
+        elif match.group('COLNAME'):
+            value = match.group('COLNAME')
+            parts[i] = FieldSelectorByColumnName(value)
+        elif match.group('REST'):
+            parts[i] = FieldSelectorByUnselected()
+        else:
+            parts[i] = FieldSelectorByColumnName(p)
+
+    return parts
+
+
+##############################################################################
+# PROJECTION
+
+class Plan(object):
+    '''The columns a Projection picks from the rows of one table.  colnums
+    count from 0, with -1 for a column that is missing.  A missing column
+    is picked as empty if padded, and skipped if not.  stripped columns
+    lose their quotes when the Projection strips.'''
+
+    __slots__ = ('colnums', 'padded', 'stripped', 'is_padded', 'is_stripped')
+
+    def __init__(self, colnums, padded, stripped):
+        self.colnums = tuple(colnums)
+        self.padded = tuple(padded)
+        self.stripped = tuple(stripped)
+        self.is_padded = all(padded)
+        self.is_stripped = all(stripped)
+
+
+class Projection(object):
+    '''The columns picked by a list of field selectors, compiled into a Plan
+    once per table instead of being looked up on every row.  The Plan is
+    compiled again when the header changes, and once per row length if a
+    selector counts columns from the end of the row.
+
+    Value regexes pick different columns on every row, so a Projection with
+    one is not compiled and selects each row through FieldSelectableRow.
+    A compiled Projection that picks the same columns from every row of a
+    table is_columnar, and can pick them from a whole Batch at a time.
+    '''
+
+    def __init__(self, selectors, inverse=False):
+        self.__selectors = selectors
+        self.__inverse = inverse
+        self.__is_relative = inverse or any(s.is_relative for s in selectors)
+        self.__schema = None
+        self.__plans = {}
+
+        self.is_compiled = not any(isinstance(s, FieldSelectorByValueRegex) for s in selectors)
+        self.is_columnar = self.is_compiled and not self.__is_relative
+
+    def plan(self, row):
+        return self.__plan(row.schema(), len(row) if self.__is_relative else None)
+
+    def __plan(self, schema, colcount):
+        if schema is not self.__schema:
+            self.__schema = schema
+            self.__plans = {}
+
+        plan = self.__plans.get(colcount)
+
+        if plan is None:
+            header = schema.as_list() if schema is not None else []
+            plan = self.__plans[colcount] = self.__compile(header, colcount)
+
+        return plan
+
+    def gather(self, row, encoded=False, strip=False):
+        '''The values picked from row, as bytes if encoded, and without their
+        quotes if strip.'''
+
+        if not self.is_compiled:
+            return self.__select(row)
+
+        return self.__gather(self.plan(row), row, encoded, strip)
+
+    def columns(self, batch, strip=False):
+        '''The values gather() picks from the rows of batch, a column at a
+        time.  A missing column is empty if padded, and None if skipped.'''
+
+        plan = self.__plan(batch.schema, None)
+        output = []
+
+        for num, is_padded, is_stripped in zip(plan.colnums, plan.padded, plan.stripped):
+            column = batch.column(num) if num >= 0 else (None,) * len(batch)
+
+            if None not in column:
+                if strip and is_stripped: column = list(map(libcsv.strip_value, column))
+            elif is_padded:
+                column = ['' if v is None else v for v in column]
+                if strip and is_stripped: column = list(map(libcsv.strip_value, column))
+            elif strip and is_stripped:
+                column = [None if v is None else libcsv.strip_value(v) for v in column]
+
+            output.append(column)
+
+        return output
+
+    def header(self, row):
+        '''The names of the columns gather() picks from row.'''
+
+        return self.__gather(self.plan(row), row.header(), False, False)
+
+    def __gather(self, plan, row, encoded, strip):
+        empty = b'' if encoded else ''
+        strip = strip and not encoded
+
+        # The usual plans are a straight pick
+        if plan.is_padded and (not strip or plan.is_stripped):
+            values = row.pick(plan.colnums, empty, encoded)
+
+            return list(map(libcsv.strip_value, values)) if strip else values
+
+        output = []
+
+        for value, is_padded, is_stripped in zip(row.pick(plan.colnums, None, encoded), plan.padded, plan.stripped):
+            if value is None:
+                if is_padded: output.append(empty)
+            elif strip and is_stripped:
+                output.append(libcsv.strip_value(value))
+            else:
+                output.append(value)
+
+        return output
+
+    def __select(self, row):
+        selectable = FieldSelectableRow(row)
+        output = []
+
+        for selector in self.__selectors:
+            output.extend(selector.select(selectable))
+
+        # Inverse only outputs unselected cells
+        if self.__inverse:
+            output = selectable.unselected()
+
+        return output
+
+    def __compile(self, header, colcount):
+        selected = set()
+        colnums = []
+        padded = []
+        stripped = []
+
+        for selector in self.__selectors:
+            if isinstance(selector, FieldSelectorByUnselected):
+                nums = [num for num in range(colcount) if num not in selected]
+            else:
+                nums = selector.columns(header, colcount)
+
+            if colcount is not None:
+                selected.update(num for num in nums if num is not None and num < colcount)
+
+            colnums += [-1 if num is None else num for num in nums]
+            padded += [selector.is_padded] * len(nums)
+            stripped += [selector.is_stripped] * len(nums)
+
+        # Inverse only outputs unselected cells
+        if self.__inverse:
+            colnums = [num for num in range(colcount) if num not in selected]
+            padded = [True] * len(colnums)
+            stripped = [False] * len(colnums)
+
+        return Plan(colnums, padded, stripped)
+
+
+class FieldSelectableRow(object):
+    def __init__(self, row):
+        self.__row = row
+        self.__selected = []
+
+    def __len__(self):
+        return len(self.__row)
+
+    def __iter__(self):
+        return self.__row.iter_values()
+
+    def header(self):
+        return self.__row.header().as_list()
+
+    def select(self, key, default=None):
+        if isinstance(key, int) and key > 0:
+            key -= 1
+        elif isinstance(key, int):
+            key = None
+
+        num = None if key is None else self.__row.colnum(key)
+        value = default if num is None else self.__row.value(num)
+
+        if num is not None:
+            self.__selected.append(num)
+
+        return value
+
+    def unselected(self):
+        unselected = []
+
+        for index in range(len(self.__row)):
+            if index not in self.__selected:
+                self.__selected.append(index)
+                unselected.append(self.__row.value(index))
+
+        return unselected
+
+
+##############################################################################
+# SELECTORS
+
+class FieldSelector(object):
+    class InvalidSelectorException(Exception): pass
+
+    # Whether the columns picked depend on the length of the row, whether a
+    # missing column is picked as empty, and whether the values are stripped
+    is_relative = False
+    is_padded = True
+    is_stripped = True
+
+    def select(self, row):
+        return []
+
+    def columns(self, header, colcount):
+        '''The numbers, counting from 0, of the columns picked from a row of
+        colcount values in a table whose column names are header.  None picks
+        a missing column.  colcount is None unless is_relative.'''
+
+        return []
+
+
+class FieldSelectorByColumnNumber(FieldSelector):
+    def __init__(self, index):
+        self.__index = index
+        self.is_relative = index <= 0
+
+    def columns(self, header, colcount):
+        index = self.__index
+
+        if index <= 0:
+            index += colcount + 1
+
+        return [index - 1 if index > 0 else None]
+
+    def select(self, row):
+        index = self.__index
+
+        if index <= 0:
+            index += len(row) + 1
+
+        value = row.select(index, '')
+
+        return [value]
+
+
+class FieldSelectorByColumnName(FieldSelector):
+    def __init__(self, key):
+        self.__key = key
+
+    def columns(self, header, colcount):
+        try:
+            colnum = header.index(self.__key)
+        except ValueError as e:
+            colnum = None
+
+        return [colnum]
+
+    def select(self, row):
+        try:
+            value = row.select(self.__key, '')
+        except ValueError as e:
+            # raise FieldSelector.InvalidSelectorException('Invalid column -- "%s"' % self.__key)
+            value = ''
+
+        return [value]
+
+
+class FieldSelectorByColumnRegex(FieldSelector):
+    def __init__(self, regex, mod):
+        if mod: regex = ('(?%s)' % mod) + regex
+
+        self.__regex_rc = re.compile(regex)
+
+    def columns(self, header, colcount):
+        return [i for i, name in enumerate(header) if self.__regex_rc.search(name)]
+
+    def select(self, row):
+        selected = []
+        colnums = []
+
+        # Column regexes to indeces
+        for i, name in enumerate(row.header()):
+            if self.__regex_rc.search(name):
+                colnums.append(i+1)
+
+        for index in colnums:
+            selected.append(row.select(index, ''))
+
+        return selected
+
+
+class FieldSelectorByColumnRange(FieldSelector):
+    is_padded = False
+    is_stripped = False
+
+    def __init__(self, start, end):
+        self.__start = start
+        self.__end = end
+        self.is_relative = (start is not None and start <= 0) or end is None or end <= 0
+
+    def columns(self, header, colcount):
+        start = self.__start
+        end = self.__end
+
+        if start is None: start = 1
+        elif start <= 0:  start += colcount + 1
+
+        if end is None: end = colcount
+        elif end <= 0:  end += colcount + 1
+
+        return list(range(max(start, 1) - 1, end))
+
+    def select(self, row):
+        colcount = len(row)
+        start = self.__start
+        end = self.__end
+        step = 1
+        values = []
+
+        if start is None: start = 1
+        elif start <= 0:  start += colcount + 1
+
+        if end is None: end = colcount
+        elif end <= 0:  end += colcount + 1
+
+        # if start > end: step = -1
+
+        for i in range(start, end+step, step):
+            value = row.select(i)
+
+            if value is not None:
+                values.append(value)
+
+        return values
+
+
+class FieldSelectorByValueRegex(FieldSelector):
+    def __init__(self, regex, mod):
+        if mod: regex = ('(?%s)' % mod) + regex
+
+        self.__regex_rc = re.compile(regex)
+
+    def select(self, row):
+        selected = []
+
+        for i, value in enumerate(row):
+            if self.__regex_rc.search(value):
+                selected.append(value)
+                row.select(i)
+
+        return selected
+
+
+class FieldSelectorByUnselected(FieldSelector):
+    is_relative = True
+    is_stripped = False
+
+    def select(self, row):
+        return row.unselected()
+
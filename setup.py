@@ -46,4 +46,7 @@ setup(
                                         "wcwidth",
                                         "importlib_resources",
                                     ],
+                   extras_require = {
+                                        "numpy": [ "numpy" ],
+                                    },
 )
@@ -0,0 +1,32 @@
+#!/usr/bin/env bash
+
+BASEDIR=$(dirname "$0")
+
+
+function bench() {
+    local TIMEFORMAT="%3R"
+    local elapsed
+
+    printf "%-64s .. " "$*"
+    elapsed=$( { time "$@" >/dev/null 2>&1; } 2>&1 )
+    echo "${elapsed}s"
+}
+
+
+function bench-commas() {
+    # Quoted cells holding 100 delimiters each
+    bench csvread commas.csv
+    bench csvcut -f2 commas.csv
+    bench csvgrep -fTAGS tag999 commas.csv
+    bench csvcsv -s commas.csv
+}
+
+
+function main() {
+    cd "$BASEDIR"
+
+    bench-commas
+}
+
+
+main "$@"
@@ -170,6 +170,9 @@ function test-csvcut() {
         test-script csvcut_${file}_${suffix}${extrasuffix} csvcut ${extraopts} -f-1 ${file}.csv
         test-script csvcut_${file}_${suffix}${extrasuffix} csvcut ${extraopts} --fields=-1 ${file}.csv
     done
+
+    # Quoted cells with many delimiters
+    test-script csvcut_commas${extrasuffix} csvcut ${extraopts} -f-1,1,2 commas.csv
 }
 
 
@@ -288,6 +291,137 @@ function test-csvgrep() {
 }
 
 
+function test-csvcsv() {
+    local file
+
+    for file in empty typical complex; do
+        test-script csvcsv_${file}_r csvcsv -r ${file}.csv
+        test-script csvcsv_${file}_r csvcsv --raw <(cat ${file}.csv)
+        test-script csvcsv_${file}_rp csvcsv -r -o p ${file}.csv
+        test-script csvcsv_${file}_rp csvcsv --raw --outdelim=p <(cat ${file}.csv)
+    done
+}
+
+
+function test-csvsql() {
+    # Only the selected columns are loaded
+    test-script csvsql_typical_fields csvsql -f '1,-1,/name/i' -a t typical.csv -c 'select * from t'
+    test-script csvsql_complex_fields csvsql --fields=-1,2-3 -a t complex.csv -c 'select * from t'
+}
+
+
+function test-pipes() {
+    local file
+
+    # Pipes are read as text rather than memory mapped
+    for file in empty typical complex; do
+        test-script csvalign_${file} csvalign <(cat ${file}.csv)
+        test-script csvcut_${file}_two_csv csvcut -f1-2 <(cat ${file}.csv)
+        test-script csvread_${file} csvread <(cat ${file}.csv)
+        test-script csvread_${file} csvread -b16 <(cat ${file}.csv)
+    done
+}
+
+
+function test-guess() {
+    # The delimiter is guessed from more than the header line
+    test-script csvalign_misleading csvalign misleading.psv
+    test-script csvalign_misleading csvalign <(cat misleading.psv)
+    test-script csvalign_misleading_r1 env CSV_SNIFF_ROWS=1 csvalign misleading.psv
+}
+
+
+function test-rows() {
+    local pass
+
+    # The second pass reads the index saved by the first; pipes have none
+    for pass in 1 2; do
+        test-script csvalign_typical_r2 csvalign -r2-3 typical.csv
+        test-script csvalign_multitable_r3 csvalign -m -r3-7 multitable.csv
+        test-script csvread_typical_r3 csvread -r3 typical.csv
+        test-script csvread_multitable_r6 csvread -m --rows=6- multitable.csv
+    done
+
+    test-script csvalign_typical_r2 csvalign -r2-3 <(cat typical.csv)
+    test-script csvalign_multitable_r3 csvalign -m -r3-7 <(cat multitable.csv)
+    test-script csvread_multitable_r6 csvread -m --rows=6- <(cat multitable.csv)
+
+    rm -f *.idx
+}
+
+
+function test-jobs() {
+    local file
+
+    # Rows split on several processes come back in their original order
+    for file in empty typical complex; do
+        test-script csvgrep_${file}__dot csvgrep -j2 . ${file}.csv
+        test-script csvcsv_${file}_r csvcsv -j2 -r ${file}.csv
+        test-script csvcsv_${file}_rp csvcsv --jobs=3 -r -o p ${file}.csv
+    done
+
+    test-script csvgrep_complex_vm_email csvgrep -j3 -m -v -f/email/i '^JDOE@EMAIL.COM$' complex.csv
+}
+
+
+function compressed-output() {
+    local zip="$1"
+
+    "$2" -z "$zip" "${@:3}" | "$zip" -dc
+}
+
+
+function test-compressed() {
+    local zip
+
+    # Compressed files and pipes are recognized by their first bytes
+    for zip in gzip bzip2 xz; do
+        $zip -c typical.csv > typical.csv.$zip
+        $zip -c complex.csv > complex.csv.$zip
+        $zip -c multitable.csv > multitable.csv.$zip
+
+        test-script csvalign_typical csvalign typical.csv.$zip
+        test-script csvcut_complex_two_csv csvcut -f1-2 complex.csv.$zip
+        test-script csvcsv_complex_r csvcsv -r <(cat complex.csv.$zip)
+        test-script csvread_multitable_r6 csvread -m --rows=6- multitable.csv.$zip
+        test-script csvalign_multitable_r3 csvalign -m -r3-7 -b16 <(cat multitable.csv.$zip)
+
+        # Output compressed by --compress decompresses to the same output
+        test-script csvcut_complex_two_csv compressed-output $zip csvcut -f1-2 complex.csv
+        test-script csvcsv_complex_r compressed-output $zip csvcsv -r complex.csv
+        test-script csvcsv_complex_rp compressed-output $zip csvcsv --jobs=3 -r -o p complex.csv
+        test-script csvgrep_complex__email compressed-output $zip csvgrep -f/email/i '^JDOE@EMAIL.COM$' complex.csv
+
+        rm -f *.$zip
+    done
+}
+
+
+function with-output() {
+    local output="output.tmp"
+
+    "$1" -O "$output" "${@:2}" && cat "$output"
+    rm -f "$output"
+}
+
+
+function test-output() {
+    local file
+
+    # Files written by --output hold the same output as stdout
+    for file in typical complex; do
+        test-script csvalign_${file} with-output csvalign ${file}.csv
+        test-script csvcut_${file}_two_csv with-output csvcut -f1-2 ${file}.csv
+        test-script csvcut_${file}_two_csv with-output csvcut -f1-2 <(cat ${file}.csv)
+        test-script csvcsv_${file}_r with-output csvcsv -r ${file}.csv
+        CSV_PREALLOCATE=1 test-script csvcsv_${file}_rp with-output csvcsv --jobs=3 -r -o p ${file}.csv
+        test-script csvread_${file} with-output csvread ${file}.csv
+    done
+
+    test-script csvgrep_complex__email with-output csvgrep -f/email/i '^JDOE@EMAIL.COM$' complex.csv
+}
+
+
 function main() {
     cd "$BASEDIR"
 
@@ -296,6 +430,29 @@ function main() {
     test-csvcut "_inv" "-v"
     test-csvread
     test-csvgrep
+    test-csvcsv
+    test-csvsql
+    test-pipes
+    test-guess
+    test-rows
+    test-jobs
+    test-compressed
+    test-output
+
+    # Alternate parsing engines must produce identical output
+    CSV_ENGINE=fsm test-csvalign
+    CSV_ENGINE=fsm test-csvread
+    CSV_ENGINE=fsm test-csvcut
+
+    # Block-buffered input must produce identical output
+    test-csvcut "" "-b16"
+
+    # Input read ahead in a background thread must produce identical output
+    CSV_PREFETCH=2 test-csvcut "" "-b16"
+    CSV_PREFETCH=2 test-pipes
+
+    # Rows split on several processes must produce identical output
+    test-csvcut "" "-j2"
 }
 
 